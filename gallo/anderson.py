@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class Anderson():
+    def __init__(self, depth=5, max_growth=1.):
+        """Anderson mixing for a fixed point iteration x = G(x), using the
+        last depth differences of the residuals G(x) - x. When the residual
+        grows by more than max_growth the history is dropped and the plain
+        iterate G(x) is used."""
+        self.depth = depth
+        self.max_growth = max_growth
+        self.mixed_steps = 0
+        self.restarts = 0
+        self.reset()
+
+    def reset(self):
+        self._delta_f = []
+        self._delta_g = []
+        self._f = None
+        self._g = None
+        self._norm = None
+
+    def update(self, x, gx):
+        # Next iterate from the current one and its image under G, any shape
+        shape = np.shape(gx)
+        # Copies, callers usually update their iterates in place
+        x = np.array(x, dtype=float).ravel()
+        gx = np.array(gx, dtype=float).ravel()
+        f = gx - x
+        norm = np.linalg.norm(f)
+        if self._f is not None:
+            if norm > self.max_growth * self._norm:
+                # Mixing made things worse, start over from the plain iterate
+                self.restarts += 1
+                self.reset()
+            else:
+                self._delta_f.append(f - self._f)
+                self._delta_g.append(gx - self._g)
+                if len(self._delta_f) > self.depth:
+                    self._delta_f.pop(0)
+                    self._delta_g.pop(0)
+        self._f, self._g, self._norm = f, gx, norm
+        if not self._delta_f:
+            return gx.reshape(shape)
+        # Combination of the previous residuals closest to the current one
+        delta_f = np.array(self._delta_f).T
+        gamma = np.linalg.lstsq(delta_f, f, rcond=None)[0]
+        mixed = gx - np.array(self._delta_g).T @ gamma
+        if not np.all(np.isfinite(mixed)):
+            self.restarts += 1
+            self.reset()
+            return gx.reshape(shape)
+        self.mixed_steps += 1
+        return mixed.reshape(shape)
@@ -0,0 +1,172 @@
+import numpy as np
+import scipy.sparse as sps
+
+
+class SparsityPattern():
+    def __init__(self, connectivity, num_nodes):
+        """Symbolic CSR structure of a P1 operator on the given elements.
+        Element matrices of shape (num_elts, 3, 3) are summed into the CSR
+        data array through a scatter map that is computed once here."""
+        connectivity = np.asarray(connectivity, dtype=np.int64)
+        rows = np.repeat(connectivity, 3, axis=1).ravel()
+        cols = np.tile(connectivity, (1, 3)).ravel()
+        # Row major keys so that np.unique returns entries in CSR order
+        keys, scatter_map = np.unique(rows * num_nodes + cols, return_inverse=True)
+        self._setup(keys, scatter_map.ravel(), num_nodes)
+
+    @classmethod
+    def from_arrays(cls, keys, scatter_map, num_nodes):
+        # Pattern from the keys and scatter_map of an earlier one, e.g. read
+        # back from a cache, without sorting the element entries again
+        pattern = cls.__new__(cls)
+        pattern._setup(np.asarray(keys, dtype=np.int64), np.asarray(scatter_map), num_nodes)
+        return pattern
+
+    def _setup(self, keys, scatter_map, num_nodes):
+        self.shape = (num_nodes, num_nodes)
+        self.scatter_map = scatter_map
+        self._keys = keys
+        self.nnz = len(keys)
+        index_dtype = np.int32 if self.nnz < np.iinfo(np.int32).max else np.int64
+        self.indices = (keys % num_nodes).astype(index_dtype)
+        row_counts = np.bincount(keys // num_nodes, minlength=num_nodes)
+        self.indptr = np.concatenate([[0], np.cumsum(row_counts)]).astype(index_dtype)
+
+    @property
+    def keys(self):
+        # Row major row * num_nodes + col key of every stored entry
+        return self._keys
+
+    def locate(self, rows, cols):
+        # Position of each (row, col) entry in the CSR data array
+        keys = (np.asarray(rows, dtype=np.int64) * self.shape[1]
+                + np.asarray(cols, dtype=np.int64))
+        pos = np.searchsorted(self._keys, keys)
+        if self.nnz == 0 or np.any(self._keys[np.minimum(pos, self.nnz - 1)] != keys):
+            raise RuntimeError("Entry outside of sparsity pattern")
+        return pos
+
+    def scatter(self, local):
+        # Sum element matrices of shape (num_elts, 3, 3) into a data array
+        return np.bincount(self.scatter_map, weights=np.ravel(local),
+                           minlength=self.nnz)
+
+    def scatter_by_material(self, local, mat_ids, num_mats):
+        # One data array per material, shape (num_mats, nnz), so operators
+        # can be rebuilt for new cross sections as a weighted sum
+        keys = np.repeat(np.asarray(mat_ids) * self.nnz, 9) + self.scatter_map
+        return np.bincount(keys, weights=np.ravel(local),
+                           minlength=num_mats * self.nnz).reshape(num_mats, self.nnz)
+
+    def scatter_at(self, positions, values):
+        # Sum values into the data array at precomputed positions
+        return np.bincount(positions, weights=np.ravel(values), minlength=self.nnz)
+
+    def scatter_coo(self, rows, cols, values):
+        # Sum individual (row, col, value) contributions into a data array
+        if len(values) == 0:
+            return np.zeros(self.nnz)
+        return np.bincount(self.locate(rows, cols), weights=values,
+                           minlength=self.nnz)
+
+    def material_matrices(self, local, mat_ids, num_mats):
+        # One CSR matrix per material
+        return [self.matrix(data)
+                for data in self.scatter_by_material(local, mat_ids, num_mats)]
+
+    def matrix(self, data):
+        return sps.csr_matrix((data, self.indices, self.indptr),
+                              shape=self.shape)
+
+    def assemble(self, local):
+        return self.matrix(self.scatter(local))
+
+
+def stiffness(fegrid):
+    # area * grad(b_n).grad(b_ns) for every element, shape (num_elts, 3, 3)
+    grads = fegrid.gradients
+    return fegrid.areas[:, None, None] * np.einsum('enk,emk->enm', grads, grads)
+
+
+def mass(fegrid, ord=3):
+    # Integral of b_n*b_ns over every element, shape (num_elts, 3, 3)
+    vals = fegrid.gauss_basis_values(ord)
+    products = vals[:, :, None] * vals[:, None, :]
+    ref = np.einsum('q,qnm->nm', fegrid.gauss_weights(ord), products)
+    return fegrid.areas[:, None, None] * ref
+
+
+def streaming(fegrid, direction):
+    # area * (direction.grad(b_n))*(direction.grad(b_ns)), shape (num_elts, 3, 3)
+    proj = fegrid.gradients @ np.asarray(direction, dtype=float)
+    return (proj[:, :, None] * proj[:, None, :]) * fegrid.areas[:, None, None]
+
+
+def streaming_components(fegrid):
+    # Kxx, Kxy, Kyy element matrices with
+    # streaming(direction) = wx^2 Kxx + 2 wx wy Kxy + wy^2 Kyy
+    gx = fegrid.gradients[:, :, 0]
+    gy = fegrid.gradients[:, :, 1]
+    area = fegrid.areas[:, None, None]
+    kxx = (gx[:, :, None] * gx[:, None, :]) * area
+    kxy = (gx[:, :, None] * gy[:, None, :] + gy[:, :, None] * gx[:, None, :]) / 2 * area
+    kyy = (gy[:, :, None] * gy[:, None, :]) * area
+    return kxx, kxy, kyy
+
+
+def boundary_mass(fegrid, coefficients=None):
+    # Integral of c*b_n*b_ns along every boundary edge, shape (num_edges, 2, 2),
+    # with coefficients c given at the edge Gauss nodes, shape (num_edges, 2)
+    vals = fegrid.boundary_basis_values()
+    products = vals[:, :, None] * vals[:, None, :]
+    weights = fegrid.boundary_weights
+    if coefficients is not None:
+        weights = weights * coefficients
+    return np.einsum('bq,qnm->bnm', weights, products)
+
+
+def streaming_source(fegrid):
+    # Gx, Gy element matrices such that (wx Gx + wy Gy) phi is the integral of
+    # phi*(w.grad(b_n)) for a linear phi, shape (num_elts, 3, 3) each
+    weights = fegrid.gradients * (fegrid.areas[:, None, None] / 3)
+    return tuple(np.repeat(weights[:, :, k, None], 3, axis=2) for k in range(2))
+
+
+def element_source(fegrid, weights):
+    # Sparse (num_nodes, num_elts) operator adding weights[e, n]*q[e] to the
+    # global node of local node n for an element-wise constant q
+    rows = fegrid.connectivity.ravel()
+    cols = np.repeat(np.arange(fegrid.num_elts), 3)
+    return sps.csr_matrix((np.ravel(weights), (rows, cols)),
+                          shape=(fegrid.num_nodes, fegrid.num_elts))
+
+
+class MaterialOperators():
+    def __init__(self, fegrid, num_mats):
+        """Per material stiffness K_m and mass M_m of a grid as data arrays
+        of its pattern, the mass matrices and the fixed source operator,
+        everything the diffusion-like operators are assembled from."""
+        self.fegrid = fegrid
+        pattern = fegrid.pattern
+        # Element matrices shared by every group
+        self.stiffness = stiffness(fegrid)
+        self.mass = mass(fegrid)
+        self.stiffness_data = pattern.scatter_by_material(self.stiffness, fegrid.mat_ids, num_mats)
+        self.mass_data = pattern.scatter_by_material(self.mass, fegrid.mat_ids, num_mats)
+        self.mass_matrices = [pattern.matrix(data) for data in self.mass_data]
+        self.source_matrix = element_source(
+            fegrid, np.repeat(fegrid.areas[:, None] / 3, 3, axis=1))
+
+    def diffusion_data(self, D, sig_r):
+        # Data of sum_m D[m] K_m + sig_r[m] M_m
+        return D @ self.stiffness_data + sig_r @ self.mass_data
+
+    def group_source(self, sig_s, group_id, source, phi_prev):
+        # Fixed source of the group and scattering in from the other groups,
+        # sum_m M_m sum_g' sig_s[m, g', g] phi_g'
+        scatmat = np.copy(sig_s[:, :, group_id])
+        scatmat[:, group_id] = 0
+        rhs_at_node = self.source_matrix @ source[group_id]
+        for midx, mass_matrix in enumerate(self.mass_matrices):
+            rhs_at_node += mass_matrix @ (scatmat[midx] @ phi_prev)
+        return rhs_at_node
@@ -0,0 +1,288 @@
+"""Timings and memory peaks of the stages of a solve on generated structured
+meshes, from parsing to upscatter acceleration, at several mesh sizes.
+
+    python -m gallo.benchmark --sizes 100 1000 10000 --output bench.json
+    python -m gallo.benchmark --baseline bench.json
+
+Results are written as JSON, with the log-log slope of the time of every
+case against the number of elements, and compared against the results of
+an earlier run to catch regressions."""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from gallo import mesh, parse
+from gallo.fe import FEGrid
+from gallo.formulations.diffusion import Diffusion
+from gallo.formulations.nda import NDA
+from gallo.formulations.saaf import SAAF
+from gallo.materials import Materials
+from gallo.quadrature import get_quadrature
+from gallo.solvers import Solver
+
+# Bumped whenever the meaning of a case or the layout of the results changes
+BENCHMARK_VERSION = 1
+
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]
+
+# One group and three groups with upscatter, see Materials for the format
+_MATERIALS = {
+    'one_group': "1 | 1\n"
+                 "0 | 0 | 'scatterer' | 2 | 1 | 1 | 0 | 0 | 0\n",
+    'three_group': "1 | 3\n"
+                   "0 | 0 | 'upscatter' | 13 | 1 | 10  1   1  | 0 | 0 | 0\n"
+                   "0 | 1 | 'upscatter' | 12 | 1 | 1   10  1  | 0 | 0 | 0\n"
+                   "0 | 2 | 'upscatter' | 12 | 1 | 0   1   10 | 0 | 0 | 0\n",
+}
+
+# Case name to (function, largest size run by default)
+CASES = {}
+
+
+def case(name, max_size=SIZES[-1]):
+    # A case takes an Environment and returns the function being measured
+    def register(func):
+        CASES[name] = (func, max_size)
+        return func
+    return register
+
+
+class Environment():
+    def __init__(self, size, directory):
+        """Square structured mesh of about size elements, its Triangle
+        files and the materials, in directory."""
+        n = max(1, int(round(np.sqrt(size / 2))))
+        self.size = size
+        self.mesh = mesh.structured_mesh(n, n)
+        self.grid = FEGrid.from_arrays(*self.mesh)
+        self.prefix = os.path.join(directory, "mesh{}".format(size))
+        self._written = False
+        self.materials = {}
+        for name, text in _MATERIALS.items():
+            path = os.path.join(directory, name + ".mat")
+            if not os.path.exists(path):
+                with open(path, 'w') as f:
+                    f.write(text)
+            self.materials[name] = Materials(path)
+        self.quadrature = get_quadrature(4)
+
+    def triangle_files(self):
+        if not self._written:
+            mesh.write_triangle(self.prefix, *self.mesh)
+            self._written = True
+        return self.prefix + ".node", self.prefix + ".ele"
+
+    def source(self, mats):
+        return np.ones((mats.num_groups, self.grid.num_elts))
+
+
+@case('parse')
+def parse_case(env):
+    node_file, ele_file = env.triangle_files()
+    return lambda: (parse.read_nodes(node_file), parse.read_elts(ele_file))
+
+
+@case('geometry')
+def geometry_case(env):
+    # Element tables and the sparsity pattern every assembly uses
+    return lambda: FEGrid.from_arrays(*env.mesh).pattern
+
+
+@case('assembly-diffusion')
+def diffusion_assembly_case(env):
+    mats = env.materials['one_group']
+    return lambda: Diffusion(env.grid, mats).make_lhs(0)
+
+
+@case('assembly-saaf')
+def saaf_assembly_case(env):
+    mats, quad = env.materials['one_group'], env.quadrature
+    return lambda: SAAF(env.grid, mats, quad).make_lhs(quad.angs, 0)
+
+
+@case('assembly-nda')
+def nda_assembly_case(env):
+    mats, quad = env.materials['one_group'], env.quadrature
+    ho_sols = (np.ones(env.grid.num_nodes), np.ones((quad.num_angs, env.grid.num_nodes)))
+    return lambda: NDA(env.grid, mats, quad).make_lhs(0, ho_sols)
+
+
+@case('rhs-diffusion')
+def diffusion_rhs_case(env):
+    mats = env.materials['three_group']
+    op = Diffusion(env.grid, mats)
+    source, phis = env.source(mats), np.ones((mats.num_groups, env.grid.num_nodes))
+    return lambda: op.make_rhs(0, source, phis)
+
+
+@case('rhs-saaf')
+def saaf_rhs_case(env):
+    mats, quad = env.materials['three_group'], env.quadrature
+    op = SAAF(env.grid, mats, quad)
+    source, phis = env.source(mats), np.ones((mats.num_groups, env.grid.num_nodes))
+    return lambda: op.make_rhs(0, source, quad.angs, None, phis)
+
+
+def _solve(make_op, mats, env, ua_bool=False):
+    def run():
+        solver = Solver(make_op(), verbose=False)
+        solver.solve(env.source(mats), ua_bool)
+        solver.close()
+    return run
+
+
+@case('solve-group-diffusion')
+def diffusion_solve_case(env):
+    mats = env.materials['one_group']
+    return _solve(lambda: Diffusion(env.grid, mats), mats, env)
+
+
+@case('solve-group-saaf', max_size=10**5)
+def saaf_solve_case(env):
+    mats = env.materials['one_group']
+    return _solve(lambda: SAAF(env.grid, mats, env.quadrature), mats, env)
+
+
+@case('outer-diffusion', max_size=10**5)
+def diffusion_outer_case(env):
+    mats = env.materials['three_group']
+    return _solve(lambda: Diffusion(env.grid, mats), mats, env)
+
+
+@case('outer-saaf', max_size=10**4)
+def saaf_outer_case(env):
+    mats = env.materials['three_group']
+    return _solve(lambda: SAAF(env.grid, mats, env.quadrature), mats, env)
+
+
+@case('ua-nda', max_size=10**4)
+def nda_ua_case(env):
+    mats = env.materials['three_group']
+    return _solve(lambda: NDA(env.grid, mats, env.quadrature), mats, env, ua_bool=True)
+
+
+def measure(func, repeat=3):
+    """Wall times of repeat calls of func, and the peak memory allocated
+    during one more call traced by tracemalloc, which slows it down."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def run(cases=None, sizes=SIZES, repeat=3, limits=True, verbose=True):
+    """Results of every case at every size, up to the size limit of the case
+    unless limits is False."""
+    cases = list(CASES) if cases is None else cases
+    for name in cases:
+        if name not in CASES:
+            raise RuntimeError("Unknown benchmark case: " + str(name))
+    results = []
+    with tempfile.TemporaryDirectory(prefix='gallo-bench-') as directory:
+        for size in sizes:
+            env = Environment(size, directory)
+            for name in cases:
+                func, max_size = CASES[name]
+                if limits and size > max_size:
+                    continue
+                times, peak = measure(func(env), repeat)
+                result = {'case': name, 'size': size, 'num_elts': env.grid.num_elts,
+                          'num_nodes': env.grid.num_nodes, 'times': times,
+                          'best': min(times), 'median': float(np.median(times)),
+                          'peak_bytes': peak}
+                if verbose:
+                    print("{:<24}{:>10}{:>12.4g} s{:>10.1f} MB".format(
+                        name, env.grid.num_elts, result['best'], peak / 2**20))
+                results.append(result)
+    return results
+
+
+def scaling(results):
+    # Log-log slope of the best time against the number of elements, 1 for
+    # linear scaling, of every case run at more than one size
+    slopes = {}
+    for name in dict.fromkeys(result['case'] for result in results):
+        points = [(result['num_elts'], result['best'])
+                  for result in results if result['case'] == name]
+        if len(points) > 1:
+            num_elts, best = np.log(np.array(points)).T
+            slopes[name] = float(np.polyfit(num_elts, best, 1)[0])
+    return slopes
+
+
+def report(results):
+    return {'version': BENCHMARK_VERSION,
+            'machine': {'python': platform.python_version(),
+                        'platform': platform.platform(),
+                        'numpy': np.__version__, 'scipy': scipy.__version__},
+            'results': results, 'scaling': scaling(results)}
+
+
+def compare(results, baseline, threshold=0.25):
+    """Ratios of the best times and memory peaks of results to those of the
+    same case and size in the baseline report. Entries where either grew by
+    more than threshold are regressions."""
+    if baseline.get('version') != BENCHMARK_VERSION:
+        print("Warning: baseline is from benchmark version", baseline.get('version'))
+    previous = {(result['case'], result['size']): result for result in baseline['results']}
+    comparisons = []
+    for result in results:
+        base = previous.get((result['case'], result['size']))
+        if base is None:
+            continue
+        time_ratio = result['best'] / base['best']
+        memory_ratio = result['peak_bytes'] / max(base['peak_bytes'], 1)
+        comparisons.append({'case': result['case'], 'size': result['size'],
+                            'time_ratio': time_ratio, 'memory_ratio': memory_ratio,
+                            'regression': max(time_ratio, memory_ratio) > 1 + threshold})
+    return comparisons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES,
+                        help="approximate numbers of elements")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-limits', action='store_true',
+                        help="run the slow cases at every size")
+    parser.add_argument('--output', help="JSON file the results are written to")
+    parser.add_argument('--baseline', help="JSON results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="relative growth reported as a regression")
+    args = parser.parse_args(argv)
+    results = run(args.cases, args.sizes, args.repeat, not args.no_limits)
+    for name, slope in scaling(results).items():
+        print("Scaling of {}: {:.2f}".format(name, slope))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report(results), f, indent=1)
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as f:
+        comparisons = compare(results, json.load(f), args.threshold)
+    for entry in comparisons:
+        print("{:<24}{:>10}  time x{:.2f}  memory x{:.2f}{}".format(
+            entry['case'], entry['size'], entry['time_ratio'], entry['memory_ratio'],
+            "  REGRESSION" if entry['regression'] else ""))
+    return 1 if any(entry['regression'] for entry in comparisons) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
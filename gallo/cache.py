@@ -0,0 +1,56 @@
+import hashlib
+import os
+import warnings
+from pathlib import Path
+
+import numpy as np
+
+# Bumped whenever the layout of the cached tables changes
+CACHE_VERSION = 2
+
+
+def file_hash(*paths):
+    # Hash of the contents of the input files and the cache layout. Every
+    # file is hashed on its own, so moving bytes from one file to the next
+    # changes the key.
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for path in paths:
+        file_digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2**20), b''):
+                file_digest.update(chunk)
+        digest.update(file_digest.digest())
+    return digest.hexdigest()
+
+
+def cache_path(path, suffix):
+    # Cache file next to the input, e.g. mesh.node -> mesh.node.grid.npz
+    path = Path(path)
+    return path.with_name(path.name + suffix)
+
+
+def load(path, key):
+    """Arrays stored in the cache file at path, or None when it is missing,
+    unreadable or was written for other inputs (a different key)."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data['key']) != key:
+                return None
+            return {name: data[name] for name in data.files if name != 'key'}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def save(path, key, arrays):
+    # Written to a temporary file first, so concurrent readers never see
+    # a partial cache
+    path = Path(path)
+    tmp = path.with_name(path.name + '.{}.tmp'.format(os.getpid()))
+    try:
+        with open(tmp, 'wb') as f:
+            np.savez(f, key=np.array(key), **arrays)
+        os.replace(tmp, path)
+    except OSError as e:
+        warnings.warn("Could not write cache {}: {}".format(path, e), RuntimeWarning)
+        if tmp.exists():
+            tmp.unlink()
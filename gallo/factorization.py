@@ -0,0 +1,76 @@
+import collections
+import threading
+
+import scipy.sparse.linalg as linalg
+
+from gallo import telemetry
+
+
+def factor_nbytes(factor):
+    # Approximate memory held by a SuperLU object: values and row indices of
+    # the L and U factors plus the row and column permutations
+    num_rows = factor.shape[0]
+    return factor.nnz * (8 + 4) + 2 * num_rows * 4
+
+
+class FactorizationCache():
+    def __init__(self, max_bytes=2**30):
+        """Least recently used cache of sparse LU factorizations, keyed by
+        e.g. (operator, group, angle), holding at most max_bytes of factors."""
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        # Guards the entries and counters only, so threads factor different
+        # operators at the same time
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, make_lhs):
+        # Factorization of the operator for key, calling make_lhs() only on a miss
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key][0]
+            self.misses += 1
+        lhs = make_lhs().tocsc()
+        with telemetry.phase('factorization'):
+            factor = linalg.splu(lhs)
+        self.add(key, factor)
+        return factor
+
+    def add(self, key, factor):
+        with self._lock:
+            if key in self._entries:
+                self.discard(key)
+            nbytes = factor_nbytes(factor)
+            # Factors larger than the whole budget are used once and not kept
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (factor, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                _, nbytes = self._entries.pop(key)
+                self.nbytes -= nbytes
+
+    def clear(self):
+        # Must be called when the cross sections behind cached operators change
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def solve(self, key, make_lhs, rhs):
+        return self.get(key, make_lhs).solve(rhs)
@@ -1,32 +1,49 @@
 import os
+import time
 from typing import NamedTuple, Tuple
 
 import attr
 import numpy as np
-import matplotlib.tri as tri
-
-from gallo import parse
-
-def setup_ang_quad(sn_ord):
-    quad1d, solid_angle = np.polynomial.legendre.leggauss(sn_ord), 4*np.pi
-    # loop over relevant polar angles
-    angs = []
-    weights = []
-    for polar in range(int(sn_ord/2), sn_ord):
-        # calculate number of points per level
-        p_per_level = 4 * (sn_ord - polar)
-        delta = 2.0 * np.pi / p_per_level
-        # get the polar angles
-        mu = quad1d[0][polar]
-        # calculate point weight
-        weight = quad1d[1][polar] * solid_angle / p_per_level
-        # loop over azimuthal angles
-        for i in range(p_per_level):
-            phi = (i + 0.5) * delta
-            omega = np.array([(1-mu**2.)**0.5 * np.cos(phi), (1-mu**2.)**0.5 * np.sin(phi)])
-            angs.append(omega)
-            weights.append(weight)
-    return np.array(angs), np.array(weights)
+import scipy.sparse as sps
+
+from gallo import assembly, cache, parse
+
+
+# Quadrature nodes on the standard triangle for each supported order
+_STD_GAUSS_NODES = {
+    2: np.array([[0, 1/2], [1/2, 0], [1/2, 1/2]]),
+    3: np.array([[1/3, 1/3], [1/5, 1/5], [1/5, 3/5], [3/5, 1/5]]),
+    4: np.array([[0.44594849091597, 0.44594849091597],
+                 [0.44594849091597, 0.10810301816807],
+                 [0.10810301816807, 0.44594849091597],
+                 [0.09157621350977, 0.09157621350977],
+                 [0.09157621350977, 0.81684757298046],
+                 [0.81684757298046, 0.09157621350977]]),
+}
+
+# Quadrature weights as fractions of the element area, see gauss_quad
+_STD_GAUSS_WEIGHTS = {
+    2: np.full(3, 1/3),
+    3: np.array([-27/48, 25/48, 25/48, 25/48]),
+    4: np.array([0.22338158967801]*3 + [0.10995174365532]*3),
+}
+
+# Outward normals of the xmax, xmin, ymax and ymin sides of the bounding box,
+# in the order assign_normal checks them
+_SIDE_NORMALS = np.array([[1, 0], [-1, 0], [0, 1], [0, -1]])
+
+# Local node pairs forming the three edges of a triangle
+_LOCAL_EDGES = np.array([[0, 1], [1, 2], [2, 0]])
+
+# Two point Gauss nodes along an edge, as fractions of the way from its
+# first to its second vertex
+_EDGE_GAUSS_NODES = np.array([1 - 1/np.sqrt(3), 1 + 1/np.sqrt(3)]) / 2
+
+
+def _frozen(array):
+    # Precomputed tables are shared by every caller, guard against writes
+    array.flags.writeable = False
+    return array
 
 
 @attr.s(slots=True, frozen=True, auto_attribs=True, repr=False)
@@ -53,37 +70,215 @@ class Node:
 class FEGrid():
     # Discretization Orders
     num_gauss_nodes = 4
-    sn_ord = 2
-    angs, weights = setup_ang_quad(sn_ord)
-    num_angs = len(weights)
-    def __init__(self, node_file, ele_file):
-        self.elts_list = parse.parse_elts(ele_file)
+    # Tables kept in the binary cache, everything the parser and
+    # _setup_tables produce
+    _cached_tables = ('_node_ids', '_elt_ids', 'positions', 'interior',
+                      'connectivity', 'mat_ids', 'vertex_coords', 'areas',
+                      'basis_coefs', 'gradients', 'centroids', 'node_sides',
+                      'boundary_elts', 'boundary_local', 'boundary_verts',
+                      'boundary_normals', 'boundary_lengths', 'boundary_gauss',
+                      'boundary_weights')
+
+    def __init__(self, node_file, ele_file, cache=False):
+        """With cache, the parsed mesh, its geometry tables and sparsity
+        pattern are stored in a .npz file next to node_file and read back
+        while the contents of both input files are unchanged."""
+        self._init_state()
+        if cache:
+            self._load(node_file, ele_file)
+        else:
+            self._parse(node_file, ele_file)
+
+    @classmethod
+    def from_arrays(cls, positions, interior, connectivity, mat_ids):
+        """Grid of a mesh held in memory, e.g. a generated one, with node i
+        at positions[i] and element e on the nodes connectivity[e]."""
+        grid = cls.__new__(cls)
+        grid._init_state()
+        start = time.perf_counter()
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        grid._node_ids = np.arange(len(positions))
+        grid._elt_ids = np.arange(len(connectivity))
+        grid.xmin, grid.xmax, grid.ymin, grid.ymax = parse.extrema(positions)
+        grid._setup_tables(positions, interior, connectivity, mat_ids)
+        grid.timings['geometry'] = time.perf_counter() - start
+        return grid
+
+    def _init_state(self):
+        # Node and Element objects are only built when asked for
+        self._nodes = None
+        self._elts_list = None
+        self._gauss_tables = {}
+        self._interpolation = {}
+        self._pattern = None
+        self._boundary_map = None
+        # Seconds spent reading the inputs (or the cache) and computing the
+        # geometry tables, see SolveReport.setup
+        self.timings = {'parse': 0., 'geometry': 0.}
+
+    def _parse(self, node_file, ele_file):
+        start = time.perf_counter()
+        self._elt_ids, connectivity, mat_ids = parse.read_elts(ele_file)
+        self._node_ids, positions, interior = parse.read_nodes(node_file)
+        self.xmin, self.xmax, self.ymin, self.ymax = parse.extrema(positions)
+        parsed = time.perf_counter()
+        self._setup_tables(positions, interior, connectivity, mat_ids)
+        self.timings['parse'] = parsed - start
+        self.timings['geometry'] = time.perf_counter() - parsed
+
+    def _load(self, node_file, ele_file):
+        path = cache.cache_path(node_file, '.grid.npz')
+        start = time.perf_counter()
+        key = cache.file_hash(node_file, ele_file)
+        tables = cache.load(path, key)
+        if tables is not None:
+            self.xmin, self.xmax, self.ymin, self.ymax = tables['extrema']
+            for name in self._cached_tables:
+                setattr(self, name, _frozen(tables[name]))
+            self._pattern = assembly.SparsityPattern.from_arrays(
+                tables['pattern_keys'], tables['scatter_map'], self.num_nodes)
+            self.timings['parse'] = time.perf_counter() - start
+            return
+        # Missing or stale, parse the inputs and write a new cache
+        self._parse(node_file, ele_file)
+        tables = {name: getattr(self, name) for name in self._cached_tables}
+        tables['extrema'] = np.array([self.xmin, self.xmax, self.ymin, self.ymax])
+        tables['pattern_keys'] = self.pattern.keys
+        tables['scatter_map'] = self.pattern.scatter_map
+        cache.save(path, key, tables)
+
+    def _setup_tables(self, positions, interior, connectivity, mat_ids):
+        # Element geometry is fixed once the mesh is read, so compute it for
+        # every element at once and serve the per-element methods from these
+        # (num_elts, ...) arrays.
+        self.positions = _frozen(np.asarray(positions, dtype=float).reshape(-1, 2))
+        self.interior = _frozen(np.asarray(interior, dtype=bool))
+        self.connectivity = _frozen(np.asarray(connectivity, dtype=int).reshape(-1, 3))
+        self.mat_ids = _frozen(np.asarray(mat_ids, dtype=int))
+        # (num_elts, 3, 2) vertex coordinates
+        self.vertex_coords = _frozen(self.positions[self.connectivity])
+        dx = self.vertex_coords[:, 1:] - self.vertex_coords[:, :1]
+        # WARNING: the following calculation is correct for triangles in 2D *only*.
+        self.areas = _frozen(np.abs(dx[:, 0, 0] * dx[:, 1, 1]
+                                    - dx[:, 1, 0] * dx[:, 0, 1]) / 2)
+        # Column n of basis_coefs[e] holds c1, c2, c3 of c1 + c2x + c3y
+        vandermonde = np.ones((self.num_elts, 3, 3))
+        vandermonde[:, :, 1:] = self.vertex_coords
+        self.basis_coefs = _frozen(np.linalg.inv(vandermonde))
+        # gradients[e, n] is the (constant) gradient of basis function n
+        self.gradients = _frozen(self.basis_coefs[:, 1:, :].transpose(0, 2, 1))
+        self.centroids = _frozen(self.vertex_coords.sum(axis=1) / 3)
+        self._setup_boundary()
+
+    def _setup_boundary(self):
+        # Boundary edges are found once from the bounding box instead of on
+        # every call from inside the assembly loops
+        x, y = self.positions.T
+        # node_sides[i] flags nodes on the xmax, xmin, ymax and ymin sides
+        self.node_sides = _frozen(np.column_stack(
+            [x == self.xmax, x == self.xmin, y == self.ymax, y == self.ymin]))
+        verts = self.connectivity[:, _LOCAL_EDGES]
+        shared = self.node_sides[verts[..., 0]] & self.node_sides[verts[..., 1]]
+        on_boundary = shared.any(axis=2) & ~self.interior[verts].any(axis=2)
+        elts, edges = np.nonzero(on_boundary)
+        # One row per boundary edge
+        self.boundary_elts = _frozen(elts)
+        self.boundary_local = _frozen(_LOCAL_EDGES[edges])
+        self.boundary_verts = _frozen(verts[elts, edges].reshape(-1, 2))
+        side = np.argmax(shared[elts, edges], axis=1)
+        self.boundary_normals = _frozen(_SIDE_NORMALS[side].reshape(-1, 2))
+        ends = self.positions[self.boundary_verts]
+        self.boundary_lengths = _frozen(np.linalg.norm(ends[:, 1] - ends[:, 0], axis=1))
+        # (num_edges, 2, 2) Gauss nodes and (num_edges, 2) weights
+        t = _EDGE_GAUSS_NODES[None, :, None]
+        self.boundary_gauss = _frozen(ends[:, None, 0] * (1 - t) + ends[:, None, 1] * t)
+        self.boundary_weights = _frozen(np.repeat(self.boundary_lengths[:, None] / 2, 2, axis=1))
+
+    def gauss_table(self, ord=3):
+        # Gauss nodes of every element, shape (num_elts, num_gnodes, 2)
+        if ord not in self._gauss_tables:
+            std_nodes = _STD_GAUSS_NODES[ord]
+            # x(u, v) = alpha + u(beta - alpha) + v(gamma - alpha) with
+            # alpha, beta, gamma the positions of local nodes 1, 2, 0
+            shape = np.column_stack([1 - std_nodes[:, 0] - std_nodes[:, 1],
+                                     std_nodes[:, 0], std_nodes[:, 1]])
+            pos = self.vertex_coords[:, [1, 2, 0]]
+            self._gauss_tables[ord] = _frozen(np.einsum('qk,ekj->eqj', shape, pos))
+        return self._gauss_tables[ord]
+
+    def gauss_weights(self, ord=3):
+        return _STD_GAUSS_WEIGHTS[ord]
+
+    def gauss_basis_values(self, ord=3):
+        # Value of local basis function n at Gauss node q, shape (num_gnodes, 3).
+        # Affine maps preserve barycentric coordinates, so the table is the
+        # same for every element.
+        u, v = _STD_GAUSS_NODES[ord].T
+        return np.column_stack([v, 1 - u - v, u])
+
+    def boundary_basis_values(self):
+        # Value of the edge's vertex basis functions at its Gauss nodes,
+        # shape (2 gauss nodes, 2 vertices)
+        t = _EDGE_GAUSS_NODES
+        return np.column_stack([1 - t, t])
 
-        self.nodes, extrema = parse.parse_nodes(node_file)
-        self.xmin, self.xmax, self.ymin, self.ymax = extrema
+    @property
+    def boundary_map(self):
+        # Positions of the (num_edges, 2, 2) boundary edge matrices in the
+        # data array of the sparsity pattern
+        if self._boundary_map is None:
+            verts = self.boundary_verts
+            rows = np.repeat(verts, 2, axis=1).ravel()
+            cols = np.tile(verts, (1, 2)).ravel()
+            self._boundary_map = self.pattern.locate(rows, cols)
+        return self._boundary_map
+
+    @property
+    def pattern(self):
+        # Sparsity pattern and scatter map shared by every operator on this grid
+        if self._pattern is None:
+            self._pattern = assembly.SparsityPattern(self.connectivity, self.num_nodes)
+        return self._pattern
 
     @property
     def num_nodes(self):
-        return len(self.nodes)
+        return len(self.positions)
 
     @property
     def num_elts(self):
-        return len(self.elts_list)
+        return len(self.connectivity)
+
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            self._nodes = [self.node(i) for i in range(self.num_nodes)]
+        return self._nodes
+
+    @property
+    def elts_list(self):
+        if self._elts_list is None:
+            self._elts_list = [self.element(i) for i in range(self.num_elts)]
+        return self._elts_list
 
     def is_corner(self, node_number):
-        x, y = self.node(node_number).position
-        on_xboundary = (x == self.xmax or x == self.xmin)
-        on_yboundary = (y == self.ymax or y == self.ymin)
-        return on_xboundary and on_yboundary
+        sides = self.node_sides[node_number]
+        return bool((sides[0] or sides[1]) and (sides[2] or sides[3]))
 
     def element(self, elt_number):
-        return self.elts_list[elt_number]
+        if self._elts_list is not None:
+            return self._elts_list[elt_number]
+        return Element(int(self._elt_ids[elt_number]),
+                       tuple(self.connectivity[elt_number].tolist()),
+                       int(self.mat_ids[elt_number]))
 
     def node(self, node_or_elt_number, local_node_number=None):
-        if local_node_number is None:
-            return self.nodes[node_or_elt_number]
-        else:
-            return self.nodes[self.elts_list[node_or_elt_number].vertices[local_node_number]]
+        if local_node_number is not None:
+            node_or_elt_number = self.connectivity[node_or_elt_number, local_node_number]
+        if self._nodes is not None:
+            return self._nodes[node_or_elt_number]
+        return Node(tuple(self.positions[node_or_elt_number].tolist()),
+                    int(self._node_ids[node_or_elt_number]),
+                    bool(self.interior[node_or_elt_number]))
 
 
 
@@ -98,27 +293,10 @@ class FEGrid():
 
     def gradient(self, elt_number, local_node_number):
         # WARNING: The following only works for 2D triangular elements
-        element = self.elts_list[elt_number].vertices
-        xbase = self.node(elt_number, local_node_number).position
-        dx = np.zeros((2, 2))
-        for ivert in range(2):
-            other_node_number = element[(local_node_number + ivert + 1) % 3]
-            dx[ivert] = self.nodes[other_node_number].position
-            dx[ivert] -= xbase
-        det = dx[0, 0] * dx[1, 1] - dx[1, 0] * dx[0, 1]
-        retval = np.zeros(2)
-        retval[0] = (-(dx[1, 1] - dx[0, 1]) / det)
-        retval[1] = ((dx[1, 0] - dx[0, 0]) / det)
-        return retval
+        return self.gradients[elt_number, local_node_number]
 
     def basis(self, elt_number):
-        vandermonde = np.zeros((3, 3))
-        for i in range(3):
-            vandermonde[i, 0] = 1
-            vandermonde[i, 1] = self.node(elt_number, i).position[0]
-            vandermonde[i, 2] = self.node(elt_number, i).position[1]
-        coefficients = np.linalg.inv(vandermonde)
-        return coefficients
+        return self.basis_coefs[elt_number]
 
     def boundary_nonzero(self, current_vert, e):
         # returns the points on the boundary where the basis function is non zero
@@ -211,48 +389,10 @@ class FEGrid():
         # WARNING only works for 2D triangular elements
         # http://math2.uncc.edu/~shaodeng/TEACHING/math5172/Lectures/Lect_15.PDF
         # Transform the nodes on the standard triangle to the given element
-        if ord==2:
-            num_gnodes = 3
-            std_nodes = np.array([[0, 1/2], [1/2, 0], [1/2, 1/2]])
-        if ord==3:
-            num_gnodes = 4
-            # Set Standard Nodes
-            std_nodes = np.array([[1/3, 1/3], [1/5, 1/5], [1/5, 3/5], [3/5, 1/5]])
-        elif ord==4:
-            num_gnodes = 6
-            std_nodes = np.array([[0.44594849091597, 0.44594849091597],
-                                  [0.44594849091597, 0.10810301816807],
-                                  [0.10810301816807, 0.44594849091597],
-                                  [0.09157621350977, 0.09157621350977],
-                                  [0.09157621350977, 0.81684757298046],
-                                  [0.81684757298046, 0.09157621350977]])
-        # Get nodes of element
-        el_nodes = [self.node(elt_number, i) for i in [1, 2, 0]]
-        pos = np.array([el_nodes[i].position for i in range(3)])
-        area = self.element_area(elt_number)
-        # Transformation Function
-        # x(u, v) = alpha + u(beta - alpha) + v(gamma - alpha)
-        trans_nodes = np.zeros((num_gnodes, 2))
-        for i in range(num_gnodes):
-            stdnode = std_nodes[i]
-            N = np.array([[1 - stdnode[0] - stdnode[1]], [stdnode[0]], [stdnode[1]]])
-            for j in range(2):
-                trans_nodes[i, j] = np.sum(np.array([pos[k, j]*N[k] for k in range(3)]))
-        return trans_nodes
+        return self.gauss_table(ord)[elt_number]
 
     def element_area(self, elt_number):
-        e = self.elts_list[elt_number]
-        n = self.nodes[e.vertices[0]]
-        xbase = n.position
-        dx = np.zeros((2, 2))
-        for ivert in [1, 2]:
-            other_node_number = e.vertices[ivert]
-            dx[ivert - 1, :] = self.nodes[other_node_number].position
-            for idir in range(2):
-                dx[ivert - 1, idir] -= xbase[idir]
-        # WARNING: the following calculation is correct for triangles in 2D *only*.
-        area = np.abs(dx[0, 0] * dx[1, 1] - dx[1, 0] * dx[0, 1]) / 2
-        return area
+        return self.areas[elt_number]
 
     def gauss_quad(self, elt_number, f_values, ord=3):
         area = self.element_area(elt_number)
@@ -274,41 +414,16 @@ class FEGrid():
         return integral
 
     def centroid(self, elt_number):
-        e = self.elts_list[elt_number]
-        retval = np.zeros(2)
-        for i in range(2):
-            retval[i] = 0.0
-        for ivert in range(3):
-            n = self.nodes[e.vertices[ivert]]
-            x = n.position
-            for idir in range(2):
-                retval[idir] += x[idir]
-        for idir in range(2):
-            retval[idir] /= 3
-        return retval
+        return self.centroids[elt_number]
 
     def assign_normal(self, nid, bid):
-        pos_n = self.node(nid).position
-        pos_ns = self.node(bid).position
-        if (pos_n[0] == self.xmax and pos_ns[0] == self.xmax):
-            normal = np.array([1, 0])
-        elif (pos_n[0] == self.xmin and pos_ns[0] == self.xmin):
-            normal = np.array([-1, 0])
-        elif (pos_n[1] == self.ymax and pos_ns[1] == self.ymax):
-            normal = np.array([0, 1])
-        elif (pos_n[1] == self.ymin and pos_ns[1] == self.ymin):
-            normal = np.array([0, -1])
-        else:
+        shared = self.node_sides[nid] & self.node_sides[bid]
+        if not shared.any():
             return -1
-        return normal
+        return _SIDE_NORMALS[np.argmax(shared)]
 
     def boundary_basis_product(self, nid, bid, gauss_nodes, bn, bns, e):
-        pos_n = self.node(nid).position
-        pos_ns = self.node(bid).position
-        if not ((pos_n[0] == self.xmax and pos_ns[0] == self.xmax)
-                or (pos_n[0] == self.xmin and pos_ns[0] == self.xmin)
-                or (pos_n[1] == self.ymax and pos_ns[1] == self.ymax)
-                or (pos_n[1] == self.ymin and pos_ns[1] == self.ymin)):
+        if not (self.node_sides[nid] & self.node_sides[bid]).any():
             boundary_integral = 0
             return boundary_integral
         # Value of first basis function at boundary gauss nodes
@@ -323,7 +438,30 @@ class FEGrid():
         g_vals = gn_vals * gns_vals
         return g_vals
 
+    def interpolation_operator(self, ord=3):
+        # Sparse P of shape (num_elts*num_gnodes, num_nodes) evaluating a
+        # nodal field at the Gauss nodes of every element, element by element
+        if ord not in self._interpolation:
+            vals = self.gauss_basis_values(ord)
+            num_gnodes = len(vals)
+            rows = np.repeat(np.arange(self.num_elts * num_gnodes), 3)
+            cols = np.repeat(self.connectivity, num_gnodes, axis=0).ravel()
+            data = np.tile(vals.ravel(), self.num_elts)
+            self._interpolation[ord] = sps.csr_matrix(
+                (data, (rows, cols)),
+                shape=(self.num_elts * num_gnodes, self.num_nodes))
+        return self._interpolation[ord]
+
+    def values_at_gauss_nodes(self, phi, ord=3):
+        # Nodal fields of shape (..., num_nodes) evaluated at the Gauss nodes,
+        # shape (..., num_elts, num_gnodes)
+        phi = np.asarray(phi)
+        interp = self.interpolation_operator(ord)
+        vals = interp @ phi.reshape(-1, self.num_nodes).T
+        return vals.T.reshape(phi.shape[:-1] + (self.num_elts, -1))
+
     def setup_triangulation(self):
+        import matplotlib.tri as tri
         x = np.zeros(self.num_nodes)
         y = np.zeros(self.num_nodes)
         positions = (self.node(i).position for i in range(self.num_nodes))
@@ -335,6 +473,7 @@ class FEGrid():
         return triang
 
     def phi_at_gauss_nodes(self, triang, phi_prev, g_nodes):
+        import matplotlib.tri as tri
         num_groups = np.shape(phi_prev)[0]
         num_nodes = np.shape(g_nodes)[0]
         phi_vals = np.zeros((num_groups, num_nodes))
@@ -1,6 +1,6 @@
 import numpy as np
 import scipy.sparse as sps
-import scipy.sparse.linalg as linalg
+from gallo import assembly, telemetry
 from gallo.fe import *
 
 class Diffusion():
@@ -11,127 +11,63 @@ class Diffusion():
         self.num_nodes = self.fegrid.num_nodes
         self.num_elts = self.fegrid.num_elts
         self.num_gnodes = self.fegrid.num_gauss_nodes
+        # The group g operator is sum_m D[m, g] K_m + sig_r[m, g] M_m plus
+        # the group independent boundary term
+        self.material_ops = assembly.MaterialOperators(self.fegrid, self.mat_data.get_num_mats())
+        self._boundary_data = None
 
+    @telemetry.timed('assembly')
     def make_lhs(self, group_id, ho_sols=None):
-        sparse_matrix = sps.lil_matrix((self.num_nodes, self.num_nodes))
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            # Determine material index of element
-            midx = elt.mat_id
-            # Get Diffusion coefficient for material
-            D = self.mat_data.get_diff(midx, group_id)
-            # Get removal cross section
-            sig_r = self.mat_data.get_sigr(midx, group_id)
-            # Determine basis functions for element
-            coef = self.fegrid.basis(e)
-            # Determine Gauss Nodes for element
-            g_nodes = self.fegrid.gauss_nodes(e)
-            for n in range(3):
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i])
-                    for i in range(self.num_gnodes)])
-                # Get global node
-                n_global = self.fegrid.node(e, n)
-                for ns in range(3):
-                    # Coefficients of basis function
-                    bns = coef[:, ns]
-                    # Array of values of basis function evaluated at gauss nodes
-                    fns_vals = np.array([self.fegrid.evaluate_basis_function(bns, g_nodes[i])
-                        for i in range(self.num_gnodes)])
-                    # Get global node
-                    ns_global = self.fegrid.node(e, ns)
-                    # Get node IDs
-                    nid = n_global.id
-                    nsid = ns_global.id
-                    # Calculate gradients
-                    ngrad = self.fegrid.gradient(e, n)
-                    nsgrad = self.fegrid.gradient(e, ns)
+        # Diffusion coefficient and removal cross section of every material
+        D = self.mat_data.D[:, group_id]
+        sig_r = self.mat_data.sig_r[:, group_id]
+        data = self.material_ops.diffusion_data(D, sig_r) + self.boundary_data()
+        return self.fegrid.pattern.matrix(data)
 
-                    # Integrate for A (basis function derivatives)
-                    area = self.fegrid.element_area(e)
-                    inprod = np.dot(ngrad, nsgrad)
-                    sparse_matrix[nid, nsid] += D * area * inprod
+    @telemetry.timed('assembly')
+    def get_matrix(self, group_id):
+        if group_id != "all":
+            return self.make_lhs(group_id)
+        # Block system of every group, (G*N, G*N), the group operators on the
+        # diagonal and scattering from g' into g, -sum_m sig_s[m, g', g] M_m,
+        # in block (g, g')
+        blocks = [[None] * self.num_groups for _ in range(self.num_groups)]
+        for g in range(self.num_groups):
+            blocks[g][g] = self.make_lhs(g)
+            for g_prime in range(self.num_groups):
+                scat = self.mat_data.sig_s[:, g_prime, g]
+                if g_prime != g and scat.any():
+                    blocks[g][g_prime] = self.fegrid.pattern.matrix(
+                        -scat @ self.material_ops.mass_data)
+        return sps.bmat(blocks, format='csr')
 
-                    # Integrate for B (basis functions multiplied)
-                    integral = self.fegrid.gauss_quad(e, fn_vals*fns_vals)
-                    sparse_matrix[nid, nsid] += sig_r * integral
-                    if not n_global.is_interior and not ns_global.is_interior:
-                        # Assign boundary id, marks end of region along
-                        # boundary where basis function is nonzero
-                        bid = nsid
-                        # Figure out what boundary you're on
-                        if (nid == nsid) and (self.fegrid.is_corner(nid)):
-                            # If on a corner, figure out what normal we should use
-                            verts = self.fegrid.boundary_nonzero(nid, e)
-                            if verts == -1:  # Means the whole element is a corner
-                                # We have to calculate boundary integral twice,
-                                # once for each other vertex
-                                # Find the other vertices
-                                all_verts = np.array(self.fegrid.element(e).vertices)
-                                vert_local_idx = np.where(all_verts == nid)[0][0]
-                                other_verts = np.delete(all_verts, vert_local_idx)
-                                # Calculate boundary integrals for other vertices
-                                for vtx in other_verts:
-                                    bid = vtx
-                                    xis = self.fegrid.gauss_nodes1d([nid, bid], e)
-                                    basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                                    boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                                    sparse_matrix[nid,nsid] += boundary_integral
-                                continue
-                            else:
-                                bid = verts[1]
-                        # Check to make sure you're on a boundary
-                        normal = self.fegrid.assign_normal(nid, bid)
-                        if isinstance(normal, int):
-                            continue
-                        # Get Gauss Nodes for the element
-                        xis = self.fegrid.gauss_nodes1d([nid, bid], e)
-                        basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                        boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                        sparse_matrix[nid, nsid] += boundary_integral
-        return sparse_matrix
+    @telemetry.timed('assembly')
+    def get_fission_matrix(self):
+        # Fission source of the block system from the element averaged
+        # fluxes, chi[m, g] nu[m, g'] sig_f[m, g'] in block (g, g')
+        xs = self.mat_data.element_view(self.fegrid)
+        average = assembly.element_source(
+            self.fegrid, np.full((self.num_elts, 3), 1/3)).T
+        production = sps.hstack([sps.diags(xs.nu_sigf[:, g]) @ average
+                                 for g in range(self.num_groups)])
+        source_matrix = self.material_ops.source_matrix
+        emission = sps.vstack([source_matrix @ sps.diags(xs.chi[:, g])
+                               for g in range(self.num_groups)])
+        return (emission @ production).tocsr()
 
-    def make_rhs(self, group_id, source, phi_prev):
-        rhs_at_node = np.zeros(self.num_nodes)
-        # Interpolate Phi
-        triang = self.fegrid.setup_triangulation()
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            midx = elt.mat_id
-            # Determine basis functions for element
-            coef = self.fegrid.basis(e)
-            # Determine Gauss Nodes for element
-            g_nodes = self.fegrid.gauss_nodes(e)
-            for n in range(3):
-                n_global = self.fegrid.node(e, n)
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at interior gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i])
-                    for i in range(self.num_gnodes)])
-                # Get node ids
-                nid = n_global.id
-                area = self.fegrid.element_area(e)
-                # Find Phi at Gauss Nodes
-                phi_vals = self.fegrid.phi_at_gauss_nodes(triang, phi_prev, g_nodes)
-                # Multiply Phi & Basis Function
-                product = fn_vals * phi_vals
-                integral_product = np.zeros(self.num_groups)
-                for g in range(self.num_groups):
-                    integral_product[g] = self.fegrid.gauss_quad(e, product[g])
-                ssource = self.compute_scattering_source(
-                    midx, integral_product, group_id)
-                rhs_at_node[nid] += ssource
-                rhs_at_node[nid] += area*source[group_id, e]*1/3
-        return rhs_at_node
+    @telemetry.timed('rhs')
+    def make_block_rhs(self, source):
+        # Fixed source of every group for the block system, (G*N,)
+        return (self.material_ops.source_matrix @ source.T).T.ravel()
 
+    def boundary_data(self):
+        # The boundary term does not depend on the group, assemble it once
+        if self._boundary_data is None:
+            local = assembly.boundary_mass(self.fegrid)
+            self._boundary_data = self.fegrid.pattern.scatter_at(
+                self.fegrid.boundary_map, local)
+        return self._boundary_data
 
-    def compute_scattering_source(self, midx, phi, group_id):
-        scatmat = self.mat_data.get_sigs(midx)
-        ssource = 0
-        for g_prime in range(self.num_groups):
-            if g_prime != group_id:
-                ssource += scatmat[g_prime, group_id]*phi[g_prime]
-        return ssource
+    @telemetry.timed('rhs')
+    def make_rhs(self, group_id, source, phi_prev):
+        return self.material_ops.group_source(self.mat_data.sig_s, group_id, source, phi_prev)
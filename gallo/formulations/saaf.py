@@ -1,14 +1,19 @@
-import itertools as itr
-
 import numpy as np
-import scipy.sparse as sps
-import scipy.sparse.linalg as linalg
-import matplotlib.tri as tri
+
+from gallo import assembly, telemetry
+from gallo.quadrature import get_quadrature
 
 class SAAF():
-    def __init__(self, grid, mat_data):
+    def __init__(self, grid, mat_data, quadrature=None):
+        """quadrature is the angular Quadrature, S_2 by default."""
         self.fegrid = grid
         self.mat_data = mat_data
+        if quadrature is None:
+            quadrature = get_quadrature(2)
+        self.quadrature = quadrature
+        self.num_angs = quadrature.num_angs
+        self.angs = quadrature.angs
+        self.weights = quadrature.weights
         self.num_groups = self.mat_data.get_num_groups()
         self.xmax = self.fegrid.xmax
         self.ymax = self.fegrid.ymax
@@ -17,144 +22,99 @@ class SAAF():
         self.num_nodes = self.fegrid.num_nodes
         self.num_elts = self.fegrid.num_elts
         self.num_gnodes = self.fegrid.num_gauss_nodes
+        # Element matrices shared by every group and angle
+        self.mass = assembly.mass(self.fegrid)
+        # Angle independent parts of the LHS, one data array per material
+        pattern = self.fegrid.pattern
+        mat_ids = self.fegrid.mat_ids
+        num_mats = self.mat_data.get_num_mats()
+        self.mass_data = pattern.scatter_by_material(self.mass, mat_ids, num_mats)
+        self.streaming_data = np.array([
+            pattern.scatter_by_material(component, mat_ids, num_mats)
+            for component in assembly.streaming_components(self.fegrid)])
+        self.boundary_mass = assembly.boundary_mass(self.fegrid)
+        # Per material mass and streaming source matrices and fixed source
+        # operators for the RHS
+        self.mass_matrices = [pattern.matrix(data) for data in self.mass_data]
+        self.streaming_matrices = [
+            pattern.material_matrices(component, mat_ids, num_mats)
+            for component in assembly.streaming_source(self.fegrid)]
+        areas = self.fegrid.areas[:, None]
+        self.source_matrix = assembly.element_source(
+            self.fegrid, np.repeat(areas / 3, 3, axis=1))
+        self.streaming_source_matrices = [
+            assembly.element_source(self.fegrid, self.fegrid.gradients[:, :, k] * areas)
+            for k in range(2)]
 
+    @telemetry.timed('assembly')
     def make_lhs(self, angles, group_id):
-        sparse_matrix = sps.lil_matrix((self.num_nodes, self.num_nodes))
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            # Determine material index of element
-            midx = elt.mat_id
-            # Get sigt and precomputed inverse
-            inv_sigt = self.mat_data.get_inv_sigt(midx, group_id)
-            sig_t = self.mat_data.get_sigt(midx, group_id)
-            # Determine basis functions for element
-            coef = self.fegrid.basis(e)
-            # Determine Gauss Nodes for element
-            g_nodes = self.fegrid.gauss_nodes(e)
-            for n in range(3):
-                # Get global node
-                n_global = self.fegrid.node(e, n)
-                # Get global node id
-                nid = n_global.id
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i])
-                    for i in range(self.num_gnodes)])
-                for ns in range(3):
-                    # Get global node
-                    ns_global = self.fegrid.node(e, ns)
-                    # Get node IDs
-                    nsid = ns_global.id
-                    # Coefficients of basis function
-                    bns = coef[:, ns]
-                    # Array of values of basis function evaluated at gauss nodes
-                    fns_vals = np.array([self.fegrid.evaluate_basis_function(bns, g_nodes[i])
-                        for i in range(self.num_gnodes)])
-                    # Calculate gradients
-                    grad = np.array([self.fegrid.gradient(e, i) for i in [n, ns]])
-                    # Multiply basis functions together at the gauss nodes
-                    f_vals = fn_vals * fns_vals
-                    # Integrate for A (basis function derivatives)
-                    area = self.fegrid.element_area(e)
-                    A = inv_sigt * (angles @ grad[0]) * (angles @ grad[1]) * area
-                    # Integrate for B (basis functions multiplied)
-                    integral = self.fegrid.gauss_quad(e, f_vals)
-                    C = sig_t * integral
-                    sparse_matrix[nid, nsid] += A + C
-                    # Check if boundary nodes
-                    if not n_global.is_interior and not ns_global.is_interior:
-                        # Assign boundary id, marks end of region along
-                        # boundary where basis function is nonzero
-                        bid = nsid
-                        # Figure out what boundary you're on
-                        if (nid == nsid) and (self.fegrid.is_corner(nid)):
-                            # If on a corner, figure out what normal we should use
-                            verts = self.fegrid.boundary_nonzero(nid, e)
-                            if verts == -1:  # Means the whole element is a corner
-                                # We have to calculate boundary integral twice,
-                                # once for each other vertex
-                                # Find the other vertices
-                                all_verts = np.array(self.fegrid.element(e).vertices)
-                                vert_local_idx = np.where(all_verts == nid)[0][0]
-                                other_verts = np.delete(all_verts, vert_local_idx)
-                                # Calculate boundary integrals for other vertices
-                                for vtx in other_verts:
-                                    bid = vtx
-                                    normal = self.fegrid.assign_normal(nid, bid)
-                                    if angles @ normal > 0:
-                                        xis = self.fegrid.gauss_nodes1d(
-                                            [nid, bid], e)
-                                        basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                                        boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                                        sparse_matrix[nid, nsid] += angles @ normal * boundary_integral
-                                continue
-                            else:
-                                bid = verts[1]
-                        normal = self.fegrid.assign_normal(nid, bid)
-                        if isinstance(normal, int):
-                            continue
-                        if angles @ normal > 0:
-                            # Get Gauss Nodes for the element
-                            xis = self.fegrid.gauss_nodes1d([nid, bid], e)
-                            basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                            boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                            sparse_matrix[nid, nsid] += angles @ normal * boundary_integral
-                        else:
-                            pass
-        return sparse_matrix
+        # One operator for a single angle, a list of them for a
+        # (num_angs, 2) array of angles
+        angles = np.asarray(angles, dtype=float)
+        data = self.lhs_data(np.atleast_2d(angles), group_id)
+        if angles.ndim == 1:
+            return self.fegrid.pattern.matrix(data[0])
+        return [self.fegrid.pattern.matrix(row) for row in data]
+
+    @telemetry.timed('assembly')
+    def make_pair_lhs(self, angles, group_id):
+        # Operator shared by a direction and its opposite, the volume terms
+        # are the same and the boundary term is the average of the two
+        angles = np.asarray(angles, dtype=float)
+        data = self.lhs_data(np.atleast_2d(angles), group_id, paired=True)
+        return self.fegrid.pattern.matrix(data[0])
+
+    def lhs_data(self, angles, group_id, paired=False):
+        # CSR data arrays of the operators of every angle, (num_angs, nnz)
+        inv_sigt = self.mat_data.inv_sigt[:, group_id]
+        sig_t = self.mat_data.sig_t[:, group_id]
+        # Integrate for A (basis function derivatives), quadratic in the
+        # angle, so opposite directions have the same coefficients and their
+        # volume terms are assembled once
+        ang_coefs = np.column_stack([angles[:, 0]**2, 2*angles[:, 0]*angles[:, 1],
+                                     angles[:, 1]**2])
+        ang_coefs, inverse = np.unique(ang_coefs, axis=0, return_inverse=True)
+        data = np.tensordot(ang_coefs[:, :, None] * inv_sigt, self.streaming_data, 2)
+        # Integrate for C (basis functions multiplied)
+        data += sig_t @ self.mass_data
+        return data[inverse.ravel()] + self.boundary_data(angles, paired)
+
+    def boundary_data(self, angles, paired=False):
+        # Outflow boundary term, angles @ normal on edges where it is positive,
+        # or with paired |angles @ normal| / 2, the average over the direction
+        # and its opposite. (nnz,) for a single angle and (num_angs, nnz) for
+        # an array of them.
+        angles = np.asarray(angles, dtype=float)
+        projection = np.atleast_2d(angles) @ self.fegrid.boundary_normals.T
+        outflow = np.abs(projection) / 2 if paired else np.maximum(projection, 0)
+        local = outflow[:, :, None, None] * self.boundary_mass
+        nnz = self.fegrid.pattern.nnz
+        positions = np.arange(len(outflow))[:, None] * nnz + self.fegrid.boundary_map
+        data = np.bincount(positions.ravel(), weights=local.ravel(),
+                           minlength=len(outflow) * nnz).reshape(-1, nnz)
+        return data[0] if angles.ndim == 1 else data
 
+    @telemetry.timed('rhs')
     def make_rhs(self, group_id, source, angles, angle_id, phi_prev=None):
-        angles = np.array(angles)
-        rhs_at_node = np.zeros(self.num_nodes)
-        # Interpolate Phi
-        triang = self.fegrid.setup_triangulation()
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            midx = elt.mat_id
-            inv_sigt = self.mat_data.get_inv_sigt(midx, group_id)
-            # Determine basis functions for element
-            coef = self.fegrid.basis(e)
-            # Determine Gauss Nodes for element
-            g_nodes = self.fegrid.gauss_nodes(e)
-            for n in range(3):
-                n_global = self.fegrid.node(e, n)
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at interior gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i])
-                    for i in range(self.num_gnodes)])
-                # Get node ids
-                nid = n_global.id
-                ngrad = self.fegrid.gradient(e, n)
-                area = self.fegrid.element_area(e)
-                # Find Phi at Gauss Nodes
-                phi_vals = self.fegrid.phi_at_gauss_nodes(triang, phi_prev, g_nodes)
-                # First Scattering Term
-                # Multiply Phi & Basis Function
-                product = fn_vals * phi_vals
-                integral_product = np.zeros(self.num_groups)
-                for g in range(self.num_groups):
-                    integral_product[g] = self.fegrid.gauss_quad(e, product[g])
-                ssource = self.compute_scattering_source(
-                    midx, integral_product, group_id)
-                rhs_at_node[nid] += ssource / (4 * np.pi)
-                # Second Scattering Term
-                integral = np.zeros(self.num_groups)
-                for g in range(self.num_groups):
-                    integral[g] = self.fegrid.gauss_quad(e, phi_vals[g]*(angles@ngrad))
-                ssource = self.compute_scattering_source(
-                    midx, integral, group_id)
-                rhs_at_node[nid] += inv_sigt*ssource/(4*np.pi)
-                q_fixed = source[group_id, e] / (4 * np.pi)
-                rhs_at_node[nid] += q_fixed * (area / 3)
-                # Second Fixed Source Term
-                rhs_at_node[nid] += inv_sigt*q_fixed*(angles@ngrad)*area
-        return rhs_at_node
+        # (num_nodes,) for a single angle, (num_angs, num_nodes) for an array
+        moments = self.rhs_moments(group_id, source, phi_prev)
+        return moments[0] + np.asarray(angles) @ moments[1:]
 
-    def compute_scattering_source(self, midx, phi, group_id):
-        scatmat = self.mat_data.get_sigs(midx)
-        ssource = 0
-        for g_prime in range(self.num_groups):
-            ssource += scatmat[g_prime, group_id]*phi[g_prime]
-        return ssource
+    def rhs_moments(self, group_id, source, phi_prev):
+        # The RHS is linear in the angle, return its isotropic, x and y
+        # parts, shape (3, num_nodes), so all angles of a group share them
+        inv_sigt = self.mat_data.inv_sigt[:, group_id]
+        moments = np.zeros((3, self.num_nodes))
+        # Scattering Terms, sum_g' sig_s[m, g', g] phi_g' for every material
+        scat_phi = self.mat_data.sig_s[:, :, group_id] @ phi_prev
+        for midx in range(len(self.mass_matrices)):
+            moments[0] += self.mass_matrices[midx] @ scat_phi[midx]
+            for k in range(2):
+                moments[k+1] += inv_sigt[midx] * (self.streaming_matrices[k][midx] @ scat_phi[midx])
+        # Fixed Source Terms
+        q_fixed = source[group_id]
+        moments[0] += self.source_matrix @ q_fixed
+        elt_inv_sigt = self.mat_data.element_view(self.fegrid).inv_sigt[:, group_id]
+        for k in range(2):
+            moments[k+1] += self.streaming_source_matrices[k] @ (elt_inv_sigt * q_fixed)
+        return moments / (4 * np.pi)
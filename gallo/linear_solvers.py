@@ -0,0 +1,220 @@
+import abc
+import collections
+import functools
+import threading
+
+import numpy as np
+import scipy.sparse.linalg as linalg
+
+from gallo import telemetry
+from gallo.factorization import FactorizationCache, factor_nbytes
+
+
+class LinearSolver(abc.ABC):
+    # Whether solve starts from x0, so callers need to keep initial guesses
+    uses_initial_guess = True
+
+    def __init__(self):
+        # Totals over every solve, for reporting
+        self.num_solves = 0
+        self.iterations = 0
+        self.last_iterations = 0
+        # Guards the counters, and the operators kept by subclasses, against
+        # concurrent solves
+        self._lock = threading.RLock()
+
+    @abc.abstractmethod
+    def solve(self, make_lhs, rhs, key=None, x0=None, tol=None, shared=None):
+        """Solve make_lhs() x = rhs. Operators that are the same on every
+        call share a key, so their setup (factorization or preconditioner)
+        is done once, key=None rebuilds it on every call. Iterative solvers
+        start from x0 and may stop at a looser tolerance tol, and with
+        shared, a (key, make_lhs) pair of an operator close to this one,
+        are preconditioned with the preconditioner of that operator, which
+        is built once for every operator sharing it."""
+
+    def count(self, iterations):
+        with self._lock:
+            self.num_solves += 1
+            self.last_iterations = iterations
+            self.iterations += iterations
+
+    def clear(self):
+        # Must be called when the cross sections behind cached operators change
+        pass
+
+
+class Direct(LinearSolver):
+    uses_initial_guess = False
+
+    def __init__(self, factorizations=None):
+        """Sparse LU, factorizations of keyed operators are kept in a
+        FactorizationCache."""
+        super().__init__()
+        if factorizations is None:
+            factorizations = FactorizationCache()
+        self.factorizations = factorizations
+
+    @telemetry.timed('linear_solve')
+    def solve(self, make_lhs, rhs, key=None, x0=None, tol=None, shared=None):
+        self.count(0)
+        if key is None:
+            lhs = make_lhs().tocsc()
+            with telemetry.phase('factorization'):
+                return linalg.splu(lhs).solve(rhs)
+        return self.factorizations.solve(key, make_lhs, rhs)
+
+    def clear(self):
+        self.factorizations.clear()
+
+
+# The preconditioners record the memory they hold in nbytes, for the
+# operator cache of Krylov
+
+def jacobi(lhs):
+    inv_diag = 1 / lhs.diagonal()
+    precond = linalg.LinearOperator(lhs.shape, matvec=lambda x: inv_diag * x)
+    precond.nbytes = inv_diag.nbytes
+    return precond
+
+
+def ilu(lhs, drop_tol=1e-4, fill_factor=10):
+    factor = linalg.spilu(lhs.tocsc(), drop_tol=drop_tol, fill_factor=fill_factor)
+    precond = linalg.LinearOperator(lhs.shape, matvec=factor.solve)
+    precond.nbytes = factor_nbytes(factor)
+    return precond
+
+
+def block_jacobi(lhs, num_blocks):
+    # Exact solves with the diagonal blocks, e.g. the group operators of a
+    # block system of every group
+    lhs = lhs.tocsr()
+    size = lhs.shape[0] // num_blocks
+    factors = [linalg.splu(lhs[b*size:(b+1)*size, b*size:(b+1)*size].tocsc())
+               for b in range(num_blocks)]
+    def solve(x):
+        x = x.reshape(num_blocks, size)
+        return np.concatenate([factor.solve(xb) for factor, xb in zip(factors, x)])
+    precond = linalg.LinearOperator(lhs.shape, matvec=solve)
+    precond.nbytes = sum(map(factor_nbytes, factors))
+    return precond
+
+
+def _sparse_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+_METHODS = {'cg': linalg.cg, 'gmres': linalg.gmres, 'bicgstab': linalg.bicgstab}
+_PRECONDITIONERS = {None: None, 'none': None, 'jacobi': jacobi, 'ilu': ilu}
+
+
+class Krylov(LinearSolver):
+    def __init__(self, method='gmres', preconditioner='ilu', tol=1e-10,
+                 maxiter=None, restart=None, max_bytes=2**30, min_reduction=1e-2):
+        """Preconditioned Krylov solve, method is one of cg (symmetric
+        positive definite operators only), gmres or bicgstab and
+        preconditioner one of None, jacobi or ilu, or a function building
+        a preconditioner from the operator. tol is relative to the
+        norm of the RHS. Warm started solves at a looser tolerance still
+        reduce the residual of x0 by min_reduction. Keyed operators and
+        their preconditioners are kept up to max_bytes, like the
+        factorizations of Direct."""
+        super().__init__()
+        if method not in _METHODS:
+            raise RuntimeError("Unknown Krylov method: " + str(method))
+        if not callable(preconditioner) and preconditioner not in _PRECONDITIONERS:
+            raise RuntimeError("Unknown preconditioner: " + str(preconditioner))
+        self.method = method
+        self.preconditioner = preconditioner
+        self.tol = tol
+        self.maxiter = maxiter
+        self.restart = restart
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.min_reduction = min_reduction
+        self.failures = 0
+        # Least recently used keyed operators with their preconditioners
+        # and the bytes they hold
+        self._operators = collections.OrderedDict()
+
+    def setup(self, make_lhs, key=None, shared=None):
+        with self._lock:
+            if key is not None and key in self._operators:
+                self._operators.move_to_end(key)
+                return self._operators[key][:2]
+        lhs = make_lhs().tocsr()
+        nbytes = _sparse_nbytes(lhs)
+        if shared is not None:
+            # Counted with the entry of the shared operator
+            precond = self.setup(shared[1], shared[0])[1]
+        else:
+            make_precond = self.preconditioner
+            if not callable(make_precond):
+                make_precond = _PRECONDITIONERS[make_precond]
+            with telemetry.phase('preconditioner'):
+                precond = None if make_precond is None else make_precond(lhs)
+            nbytes += getattr(precond, 'nbytes', 0)
+        if key is not None:
+            self.add(key, lhs, precond, nbytes)
+        return lhs, precond
+
+    def add(self, key, lhs, precond, nbytes):
+        with self._lock:
+            if key in self._operators:
+                self.nbytes -= self._operators.pop(key)[2]
+            # Operators larger than the whole budget are used once and not kept
+            if nbytes > self.max_bytes:
+                return
+            self._operators[key] = (lhs, precond, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, _, evicted) = self._operators.popitem(last=False)
+                self.nbytes -= evicted
+
+    @telemetry.timed('linear_solve')
+    def solve(self, make_lhs, rhs, key=None, x0=None, tol=None, shared=None):
+        lhs, precond = self.setup(make_lhs, key, shared)
+        # The solver's own tolerance is the tightest a caller gets
+        tol = self.tol if tol is None else max(tol, self.tol)
+        if x0 is not None and tol > self.tol:
+            # A good initial guess may already meet a loose tolerance, the
+            # iteration calling us would then see no change and stop early
+            initial = np.linalg.norm(rhs - lhs @ x0) / np.linalg.norm(rhs)
+            tol = max(self.tol, min(tol, self.min_reduction * initial))
+        count = [0]
+        def callback(_):
+            count[0] += 1
+        options = {}
+        if self.method == 'gmres':
+            options = {'restart': self.restart, 'callback_type': 'pr_norm'}
+        x, info = _METHODS[self.method](
+            lhs, rhs, x0=x0, rtol=tol, atol=0., maxiter=self.maxiter,
+            M=precond, callback=callback, **options)
+        if info < 0:
+            raise RuntimeError("Breakdown in " + self.method + " solve")
+        if info > 0:
+            with self._lock:
+                self.failures += 1
+            telemetry.warn("{} did not converge in {} iterations".format(
+                self.method, count[0]))
+        self.count(count[0])
+        return x
+
+    def clear(self):
+        with self._lock:
+            self._operators.clear()
+            self.nbytes = 0
+
+
+def get_linear_solver(spec=None, factorizations=None, num_blocks=1):
+    """Linear solver from a LinearSolver, a name such as 'direct', 'cg',
+    'cg+jacobi', 'gmres+ilu' or 'bicgstab+ilu', or None for direct.
+    'block-jacobi' preconditions with num_blocks diagonal blocks."""
+    if isinstance(spec, LinearSolver):
+        return spec
+    if spec is None or spec == 'direct':
+        return Direct(factorizations)
+    method, _, preconditioner = spec.partition('+')
+    if preconditioner == 'block-jacobi':
+        preconditioner = functools.partial(block_jacobi, num_blocks=num_blocks)
+    return Krylov(method, preconditioner or None)
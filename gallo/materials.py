@@ -1,4 +1,8 @@
+import itertools
 import os
+import time
+import weakref
+
 import numpy as np
 
 
@@ -7,6 +11,7 @@ class Materials():
         """Constructor of materials object. Stores material data for all
         materials """
 
+        start = time.perf_counter()
         # Verify file exists
         assert os.path.exists(filename), "Material file: " + filename\
             + " does not exist"
@@ -15,37 +20,48 @@ class Materials():
             mats_groups = line.split("|")
             self.num_mats = int(mats_groups[0])
             self.num_groups = int(mats_groups[1])
-            self.names = []
-            self.sig_t = np.zeros((self.num_mats, self.num_groups))
-            self.sig_a = np.zeros((self.num_mats, self.num_groups))
-            self.sig_s = np.zeros((self.num_mats, self.num_groups,
-                                   self.num_groups))
-            self.sig_f = np.zeros((self.num_mats, self.num_groups))
-            self.D = np.zeros((self.num_mats, self.num_groups))
-            self.nu = np.zeros((self.num_mats, self.num_groups))
-            self.inv_sigt = np.zeros((self.num_mats, self.num_groups))
-            self.chi = np.zeros((self.num_mats, self.num_groups))
-            for i in range(self.num_mats):
-                line = fp.readline()
-                attributes = line.split("|")
-                self.names.append(attributes[2].strip())
-                for j in range(self.num_groups):
-                    self.sig_a[i, j] = float(attributes[4])
-                    scat = np.array(attributes[5].split())
-                    self.sig_s[i, j, :] = scat.astype(float)
-                    self.sig_t[i, j] = self.sig_a[i, j] + np.sum(self.sig_s[i, j, :])
-                    self.sig_f[i, j] = float(attributes[6])
-                    self.nu[i, j] = float(attributes[7])
-                    self.chi[i, j] = float(attributes[8])
-
-                    # Derived quantities
-                    self.D[i, j] = 1 / (3 * self.sig_t[i, j])
-                    self.inv_sigt[i, j] = 1 / self.sig_t[i, j]
-                    if j == (self.num_groups - 1):
-                        continue
-                    else:
-                        line = fp.readline()
-                        attributes = line.split("|")
+            # One row per material and group, material major
+            num_rows = self.num_mats * self.num_groups
+            rows = [line.split("|") for line in itertools.islice(fp, num_rows)]
+        assert len(rows) == num_rows, "Material file: " + filename\
+            + " has fewer than " + str(num_rows) + " rows"
+        shape = (self.num_mats, self.num_groups)
+        self.names = [rows[i * self.num_groups][2].strip() for i in range(self.num_mats)]
+        # Absorption, fission, nu and chi columns of every row
+        columns = np.array([[row[4], row[6], row[7], row[8]] for row in rows],
+                           dtype=float).T.reshape(4, *shape)
+        self.sig_a, self.sig_f, self.nu, self.chi = columns
+        self.sig_s = np.array(' '.join(row[5] for row in rows).split(),
+                              dtype=float).reshape(*shape, self.num_groups)
+        # Element indexed views of every grid, see element_view
+        self._views = weakref.WeakKeyDictionary()
+        self.update()
+        # Seconds spent reading the file, see SolveReport.setup
+        self.timings = {'parse': time.perf_counter() - start}
+
+    def update(self):
+        # Derived quantities, recomputed after sig_a or sig_s change
+        self.sig_t = self.sig_a + self.sig_s.sum(axis=2)
+        self.D = 1 / (3 * self.sig_t)
+        self.inv_sigt = 1 / self.sig_t
+        # Removal cross section, sig_t minus within group scattering
+        self.sig_r = self.sig_t - np.diagonal(self.sig_s, axis1=1, axis2=2)
+
+    def fingerprint(self):
+        # Changes whenever any cross section does, including in place edits
+        return hash(tuple(data.tobytes() for data in
+                          (self.sig_t, self.sig_a, self.sig_s, self.sig_f, self.nu,
+                           self.chi, self.D, self.inv_sigt, self.sig_r)))
+
+    def element_view(self, fegrid):
+        """Cross sections of every element of fegrid, built once per grid
+        and rebuilt when the cross sections change."""
+        fingerprint = self.fingerprint()
+        view = self._views.get(fegrid)
+        if view is None or view.fingerprint != fingerprint:
+            view = ElementCrossSections(self, fegrid.mat_ids, fingerprint)
+            self._views[fegrid] = view
+        return view
 
     def get_name(self, mat_id):
         return self.names[mat_id]
@@ -84,7 +100,26 @@ class Materials():
         return self.inv_sigt[mat_id, group_id]
 
     def get_sigr(self, mat_id, group_id):
-        scatmat = self.get_sigs(mat_id)
-        sigt = self.get_sigt(mat_id, group_id)
-        sigr = sigt - scatmat[group_id, group_id]
-        return sigr
+        return self.sig_r[mat_id, group_id]
+
+
+class ElementCrossSections():
+    def __init__(self, mat_data, mat_ids, fingerprint):
+        """Cross sections gathered by element material id, e.g.
+        sig_t[e, g] is sig_t of the material of element e, shape
+        (num_elts, num_groups)."""
+        self.mat_data = mat_data
+        self.mat_ids = mat_ids
+        self.fingerprint = fingerprint
+        self.sig_t = mat_data.sig_t[mat_ids]
+        self.sig_a = mat_data.sig_a[mat_ids]
+        self.sig_r = mat_data.sig_r[mat_ids]
+        self.D = mat_data.D[mat_ids]
+        self.inv_sigt = mat_data.inv_sigt[mat_ids]
+        self.nu_sigf = (mat_data.nu * mat_data.sig_f)[mat_ids]
+        self.chi = mat_data.chi[mat_ids]
+
+    def sig_s(self, group_id):
+        # Scattering from every group into group_id, (num_elts, num_groups),
+        # gathered on demand as the full matrices grow with num_groups**2
+        return self.mat_data.sig_s[self.mat_ids, :, group_id]
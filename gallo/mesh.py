@@ -0,0 +1,40 @@
+import numpy as np
+
+from gallo.fe import FEGrid
+
+
+def structured_mesh(nx, ny, width=1., height=1., num_mats=1):
+    """Triangulation of the width by height rectangle at the origin into nx
+    by ny cells, each split in two along its diagonal, 2 nx ny elements.
+    The materials are num_mats vertical stripes of equal width. Returns the
+    positions, interior flags, connectivity and material ids of the mesh,
+    as FEGrid.from_arrays takes them."""
+    # Node j (nx + 1) + i at (x_i, y_j)
+    x, y = np.meshgrid(np.linspace(0, width, nx + 1), np.linspace(0, height, ny + 1))
+    positions = np.column_stack([x.ravel(), y.ravel()])
+    i, j = np.meshgrid(np.arange(nx + 1), np.arange(ny + 1))
+    interior = ((i > 0) & (i < nx) & (j > 0) & (j < ny)).ravel()
+    # Counterclockwise lower right and upper left triangles of every cell
+    i, j = np.meshgrid(np.arange(nx), np.arange(ny))
+    lower_left = (j * (nx + 1) + i).ravel()
+    upper_left = lower_left + nx + 1
+    connectivity = np.stack([
+        np.column_stack([lower_left, lower_left + 1, upper_left + 1]),
+        np.column_stack([lower_left, upper_left + 1, upper_left])], axis=1).reshape(-1, 3)
+    mat_ids = np.repeat(i.ravel() * num_mats // nx, 2)
+    return positions, interior, connectivity, mat_ids
+
+
+def structured_grid(nx, ny, width=1., height=1., num_mats=1):
+    return FEGrid.from_arrays(*structured_mesh(nx, ny, width, height, num_mats))
+
+
+def write_triangle(prefix, positions, interior, connectivity, mat_ids):
+    # Mesh as the Triangle prefix.node and prefix.ele files FEGrid reads
+    num_nodes, num_elts = len(positions), len(connectivity)
+    nodes = np.column_stack([np.arange(num_nodes), positions, ~np.asarray(interior)])
+    np.savetxt(str(prefix) + ".node", nodes, fmt=['%d', '%.17g', '%.17g', '%d'],
+               header="{} 2 0 1".format(num_nodes), comments='')
+    elts = np.column_stack([np.arange(num_elts), connectivity, mat_ids])
+    np.savetxt(str(prefix) + ".ele", elts, fmt='%d',
+               header="{} 3 1".format(num_elts), comments='')
@@ -1,57 +1,90 @@
 from pathlib import Path
 
+import numpy as np
+
 from gallo import fe
 
 oo = float('inf')
 
 def parse_num_lines(line):
-    return int(line.split(' ')[0])
+    return int(line.split()[0])
+
+
+def _read_table(path, kind, dtype):
+    # Header fields and the data rows of a Triangle file as one array,
+    # comments and blank lines are skipped
+    path = Path(path)
+    assert path.exists(), "{} file: {} does not exist.".format(kind, path)
+    with path.open() as f:
+        header = f.readline()
+        while header and header.partition('#')[0].strip() == '':
+            header = f.readline()
+        num_lines = parse_num_lines(header)
+        table = np.loadtxt(f, dtype=dtype, comments='#', ndmin=2)
+    if num_lines != len(table):
+        raise ValueError("{} file: {} has {} rows, the header says {}".format(
+            kind, path, len(table), num_lines))
+    return [int(field) for field in header.partition('#')[0].split()], table
+
+
+def read_nodes(node_file):
+    # Ids, (num_nodes, 2) positions and interior flags of every node, from
+    # the first boundary marker
+    header, table = _read_table(node_file, "Node", float)
+    if len(header) != 4:
+        raise ValueError("Node file: {} header is not "
+                         "'nodes dimension attributes markers'".format(node_file))
+    _, dim, num_attrs, num_markers = header
+    if dim != 2 or num_markers < 1:
+        raise ValueError("Node file: {} must have 2D nodes with a boundary "
+                         "marker".format(node_file))
+    if len(table) and table.shape[1] != 3 + num_attrs + num_markers:
+        raise ValueError("Node file: {} rows do not have {} columns".format(
+            node_file, 3 + num_attrs + num_markers))
+    ids = table[:, 0].astype(int)
+    positions = np.ascontiguousarray(table[:, 1:3])
+    is_interior = table[:, 3 + num_attrs] == 0
+    return ids, positions, is_interior
+
+
+def read_elts(ele_file):
+    # Ids, (num_elts, 3) vertices and material ids of every element, from
+    # the first attribute, 0 without attributes
+    header, table = _read_table(ele_file, "Ele", np.int64)
+    if len(header) < 3:
+        raise ValueError("Ele file: {} header is not "
+                         "'elements nodes attributes'".format(ele_file))
+    _, num_verts, num_attrs = header[:3]
+    if num_verts != 3:
+        raise ValueError("Ele file: {} must have 3 node triangles".format(ele_file))
+    # Files are often written with a material column but no attributes
+    columns = (4 + num_attrs, 4 + max(num_attrs, 1))
+    if len(table) and table.shape[1] not in columns:
+        raise ValueError("Ele file: {} rows do not have {} columns".format(
+            ele_file, 4 + num_attrs))
+    if len(table) and table.shape[1] > 4:
+        mat_ids = table[:, 4]
+    else:
+        mat_ids = np.zeros(len(table), dtype=np.int64)
+    return (np.ascontiguousarray(table[:, 0]), np.ascontiguousarray(table[:, 1:4]),
+            np.ascontiguousarray(mat_ids))
 
 
-def _split_and_remove_whitespace(line):
-    return ' '.join(line.split()).split(' ')
+def extrema(positions):
+    if len(positions) == 0:
+        return oo, -oo, oo, -oo
+    (xmin, ymin), (xmax, ymax) = positions.min(axis=0), positions.max(axis=0)
+    return xmin, xmax, ymin, ymax
 
 
 def parse_nodes(node_file):
-    node_file = Path(node_file)
-    assert node_file.exists(), "Node file: {} does not exist.".format(node_file)
-    with node_file.open() as nf:
-        num_nodes = parse_num_lines(nf.readline())
-        nodes = []
-
-        xmin = ymin = oo
-        xmax = ymax = -oo
-        for line in nf.readlines():
-            if line.startswith('#'):
-                continue
-            if line.strip() == '':
-                continue
-            node_id, x, y, boundary =  _split_and_remove_whitespace(line)
-            x, y = float(x), float(y)
-            # Set boundary data
-            xmin = min(x, xmin)
-            ymin = min(y, ymin)
-
-            xmax = max(x, xmax)
-            ymax = max(y, ymax)
-
-            is_interior = not int(boundary)
-            nodes.append(fe.Node((x, y), int(node_id), is_interior))
-    assert num_nodes == len(nodes)
-    return nodes, (xmin, xmax, ymin, ymax)
+    ids, positions, is_interior = read_nodes(node_file)
+    nodes = [fe.Node(tuple(pos), node_id, interior) for node_id, pos, interior
+             in zip(ids.tolist(), positions.tolist(), is_interior.tolist())]
+    return nodes, extrema(positions)
 
 
 def parse_elts(ele_file):
-    ele_file = Path(ele_file)
-    assert ele_file.exists(), "Ele file: {} does not exist.".format(ele_file)
-    with ele_file.open() as ef:
-        num_elts = parse_num_lines(ef.readline())
-        elts_list = []
-        for line in ef.readlines():
-            if line.startswith('#'):
-                continue
-            el_id, *vertices, mat_id = _split_and_remove_whitespace(line)
-            vertices = tuple(int(vert) for vert in vertices)
-            elts_list.append(fe.Element(int(el_id), vertices, int(mat_id)))
-    assert num_elts == len(elts_list)
-    return elts_list
+    ids, vertices, mat_ids = read_elts(ele_file)
+    return [fe.Element(el_id, tuple(verts), mat_id) for el_id, verts, mat_id
+            in zip(ids.tolist(), vertices.tolist(), mat_ids.tolist())]
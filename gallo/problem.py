@@ -22,6 +22,11 @@ class Problem(NamedTuple):
     def num_groups(self):
         return self.mats.num_groups
 
+    @property
+    def quadrature(self):
+        # Angular quadrature of the transport operators, None for Diffusion
+        return getattr(self.op, 'quadrature', None)
+
     @property
     def matrix(self):
         return self.op.get_matrix("all")
@@ -0,0 +1,66 @@
+import functools
+
+import numpy as np
+
+
+def setup_ang_quad(sn_ord):
+    quad1d, solid_angle = np.polynomial.legendre.leggauss(sn_ord), 4*np.pi
+    # loop over relevant polar angles
+    angs = []
+    weights = []
+    for polar in range(int(sn_ord/2), sn_ord):
+        # calculate number of points per level
+        p_per_level = 4 * (sn_ord - polar)
+        delta = 2.0 * np.pi / p_per_level
+        # get the polar angles
+        mu = quad1d[0][polar]
+        # calculate point weight
+        weight = quad1d[1][polar] * solid_angle / p_per_level
+        # loop over azimuthal angles
+        for i in range(p_per_level):
+            phi = (i + 0.5) * delta
+            omega = np.array([(1-mu**2.)**0.5 * np.cos(phi), (1-mu**2.)**0.5 * np.sin(phi)])
+            angs.append(omega)
+            weights.append(weight)
+    return np.array(angs), np.array(weights)
+
+
+def _frozen(array):
+    array.flags.writeable = False
+    return array
+
+
+class Quadrature():
+    def __init__(self, sn_ord=2):
+        """S_N angular quadrature projected to the x-y plane, sn_ord even
+        from 2 to 16, with sn_ord (sn_ord + 2) / 2 directions. The weights
+        of both hemispheres are folded into each direction and sum to
+        4 pi."""
+        if sn_ord % 2 or not 2 <= sn_ord <= 16:
+            raise RuntimeError("S_N order must be even, from 2 to 16: " + str(sn_ord))
+        self.sn_ord = sn_ord
+        angs, weights = setup_ang_quad(sn_ord)
+        # Index of the direction opposite to every direction, the pairs
+        # share their SAAF volume operator
+        distance = np.linalg.norm(angs[:, None] + angs[None], axis=2)
+        self.opposite = _frozen(np.argmin(distance, axis=1))
+        if not np.allclose(distance[np.arange(len(angs)), self.opposite], 0):
+            raise RuntimeError("S_N quadrature is not symmetric")
+        # Exactly opposite, so that products of direction cosines match
+        first = np.arange(len(angs)) < self.opposite
+        angs[self.opposite[first]] = -angs[first]
+        # (num_angs, 2) directions and (num_angs,) weights
+        self.angs = _frozen(angs)
+        self.weights = _frozen(weights)
+        self.num_angs = len(weights)
+        # Omega Omega^T of every direction, (num_angs, 2, 2)
+        self.outer = _frozen(np.einsum('ai,aj->aij', angs, angs))
+
+    def __repr__(self):
+        return "Quadrature(sn_ord={})".format(self.sn_ord)
+
+
+@functools.lru_cache(maxsize=None)
+def get_quadrature(sn_ord=2):
+    # Quadratures are immutable, problems of the same order share one
+    return Quadrature(sn_ord)
@@ -1,66 +1,317 @@
-import itertools as itr
+import concurrent.futures
+import contextlib
+import threading
 import time
 
 import numpy as np
-import scipy.sparse as sps
 import scipy.sparse.linalg as linalg
-import matplotlib.tri as tri
 
+from gallo import assembly, telemetry
+from gallo.anderson import Anderson
+from gallo.factorization import FactorizationCache
+from gallo.linear_solvers import get_linear_solver
+from gallo.storage import InMemory, get_storage
+from gallo.telemetry import Telemetry
 from gallo.formulations.diffusion import Diffusion
 from gallo.formulations.nda import NDA
 from gallo.formulations.saaf import SAAF
 from gallo.upscatter_acceleration import UA
 
 class Solver():
-    def __init__(self, operator):
+    # Krylov vectors kept by the within-group GMRES between restarts
+    gmres_restart = 20
+
+    def __init__(self, operator, factorizations=None, linear_solver=None,
+                 ho_linear_solver=None, ua_linear_solver='gmres+ilu',
+                 inexact=True, forcing=1e-2, max_inner_tol=1e-2, angle_workers=1,
+                 outer='gauss-seidel', group_workers=None, block_linear_solver=None,
+                 inner='source-iteration', anderson_depth=0,
+                 pair_preconditioners=False, angular_storage='memory', storage_path=None,
+                 verbose=False, timing=False, callbacks=()):
+        """linear_solver, ho_linear_solver (the SAAF solves of NDA) and
+        ua_linear_solver are LinearSolvers or names understood by
+        get_linear_solver. By default Diffusion and SAAF are solved
+        directly and the nonsymmetric NDA and UA operators with GMRES.
+        With inexact, iterative inner solves stop at forcing times the
+        current iteration residual, but never looser than max_inner_tol.
+        The SAAF angles of a group are solved by angle_workers threads.
+        outer is 'gauss-seidel' or 'jacobi', the latter solves the groups
+        receiving upscatter concurrently on group_workers threads, or for
+        Diffusion 'block', which solves the system of every group at once
+        with block_linear_solver, e.g. 'gmres+block-jacobi'. inner is
+        'source-iteration' or for SAAF 'gmres', which solves the within-group
+        problem with GMRES, the residual norms of every group are kept in
+        krylov_residuals. anderson_depth > 0 mixes the outer iterates with
+        Anderson acceleration of that depth. With pair_preconditioners,
+        iterative SAAF solves of a direction and its opposite share one
+        preconditioner, built from their averaged operator. This halves
+        the preconditioners kept but roughly doubles the iterations.
+        angular_storage keeps the SAAF angular fluxes (and for NDA with
+        upscatter acceleration the high order ones) in 'memory', in a
+        'memmap' file at storage_path, a temporary file by default, or
+        with 'moments' only their currents, solve then returns None for
+        them. The storage is available as angular_storage. With the latter
+        two, angular fluxes are only held in RAM for the groups being
+        solved, the warm starts of the others are read from the storage.
+        verbose is the default of the progress printing of every solve, convergence
+        failures are reported as ConvergenceWarnings. Each solve collects
+        a SolveReport, kept in report, of its residual histories and linear
+        solver statistics, and with timing the time spent in each phase
+        (assembly, rhs, interpolation, factorization, linear_solve, ua, ...).
+        Every callback is called with the telemetry Event of each
+        iteration as it happens."""
         self.op = operator
         self.ua_bool = False
+        self.inexact = inexact
+        self.forcing = forcing
+        self.max_inner_tol = max_inner_tol
+        # Last solution of every (group, angle) and group, initial guesses
+        # for the next solve
+        self.guesses = {}
+        # Storages to start the angles of a solved group from, when its
+        # angular fluxes are not kept in guesses
+        self._guess_storages = {}
+        # Relative change of the current within-group iteration of every
+        # group and of the outer iteration
+        self.residuals = {}
+        self.outer_residual = 1.
+        self.angle_workers = angle_workers
+        self._angle_pool = None
+        if outer not in ('gauss-seidel', 'jacobi', 'block'):
+            raise RuntimeError("Unknown outer iteration: " + str(outer))
+        if outer == 'block' and not isinstance(self.op, Diffusion):
+            raise RuntimeError("Block solves are only implemented for Diffusion")
+        self.outer = outer
+        if inner not in ('source-iteration', 'gmres'):
+            raise RuntimeError("Unknown inner iteration: " + str(inner))
+        if inner == 'gmres' and not isinstance(self.op, SAAF):
+            raise RuntimeError("Krylov within-group iterations are only implemented for SAAF")
+        self.inner = inner
+        self.krylov_residuals = {}
+        self.anderson_depth = anderson_depth
+        self.anderson = None
+        self.pair_preconditioners = pair_preconditioners
+        self.group_workers = group_workers
+        self._group_pool = None
+        # Diffusion and SAAF operators are the same on every iteration, only
+        # the RHS changes, so their factorizations are kept and reused
+        if factorizations is None:
+            factorizations = FactorizationCache()
+        self.factorizations = factorizations
+        if linear_solver is None and isinstance(self.op, NDA):
+            linear_solver = 'gmres+ilu'
+        self.linear_solver = get_linear_solver(linear_solver, self.factorizations)
+        self.ua_linear_solver = get_linear_solver(ua_linear_solver, self.factorizations)
+        self.block_linear_solver = get_linear_solver(
+            block_linear_solver, self.factorizations, num_blocks=self.op.num_groups)
         if isinstance(self.op, NDA):
-            self.ho_op = SAAF(self.op.fegrid, self.op.mat_data)
+            self.ho_op = SAAF(self.op.fegrid, self.op.mat_data, self.op.quadrature)
+            self.ho_solver = Solver(self.ho_op, factorizations=self.factorizations,
+                                    linear_solver=ho_linear_solver, inexact=inexact,
+                                    forcing=forcing, max_inner_tol=max_inner_tol,
+                                    angle_workers=angle_workers,
+                                    pair_preconditioners=pair_preconditioners)
         self.mat_data = self.op.mat_data
         self.num_groups = self.op.num_groups
         self.num_nodes = self.op.num_nodes
         self.num_elts = self.op.num_elts
         self.num_mats = self.mat_data.get_num_mats()
-        self.num_angs = self.op.fegrid.num_angs
-        self.angs = self.op.fegrid.angs
-        self.weights = self.op.fegrid.weights
-
-    def get_ang_flux(self, group_id, source, ang, angle_id, phi_prev):
-        lhs = self.op.make_lhs(ang, group_id).tocsr()
-        rhs = self.op.make_rhs(group_id, source, ang, angle_id, phi_prev)
-        ang_flux = linalg.cg(lhs, rhs)[0]
-        #ang_flux = linalg.spsolve(lhs, rhs)
+        # Angular quadrature of the transport operators, None for Diffusion
+        self.quadrature = getattr(self.op, 'quadrature', None)
+        if self.quadrature is not None:
+            self.num_angs = self.quadrature.num_angs
+            self.angs = self.quadrature.angs
+            self.weights = self.quadrature.weights
+        # Created on the first solve that keeps angular fluxes
+        self._storage_spec = (angular_storage, storage_path)
+        self.angular_storage = None
+        # SAAF operators built with the rest of their group, not yet used
+        self._pending_lhs = {}
+        self._lhs_lock = threading.Lock()
+        # Cross sections the cached operators were built from
+        self._mat_fingerprint = self.mat_data.fingerprint()
+        self.verbose = verbose
+        self.timing = timing
+        self.callbacks = list(callbacks)
+        # Telemetry of the current or last solve and the report of the last
+        self.telemetry = Telemetry(timing, self.callbacks)
+        self.report = None
+
+    def inner_tol(self, group_id):
+        # Inexact inner solves, loose while the iteration is far from converged
+        if not self.inexact:
+            return None
+        residual = self.residuals.get(group_id, self.outer_residual)
+        return min(self.max_inner_tol, self.forcing * residual)
+
+    def get_ang_flux(self, group_id, source, ang, angle_id, phi_prev, rhs=None):
+        if rhs is None:
+            rhs = self.op.make_rhs(group_id, source, ang, angle_id, phi_prev)
+        key = (self.op, group_id, angle_id)
+        shared = None
+        if self.pair_preconditioners:
+            # A direction and its opposite share the preconditioner of
+            # their averaged operator
+            pair_id = min(angle_id, self.quadrature.opposite[angle_id])
+            shared = ((self.op, group_id, 'pair', pair_id),
+                      lambda: self.op.make_pair_lhs(self.angs[angle_id], group_id))
+        ang_flux = self.linear_solver.solve(
+            lambda: self.angle_lhs(group_id, angle_id), rhs, key=key,
+            x0=self.angle_guess(group_id, angle_id), tol=self.inner_tol(group_id),
+            shared=shared)
+        # Kept only for solvers that start from them, so the angular fluxes
+        # of every group are not held in memory for nothing
+        if self.linear_solver.uses_initial_guess:
+            self.guesses[(group_id, angle_id)] = ang_flux
         return ang_flux
 
+    def angle_guess(self, group_id, angle_id):
+        guess = self.guesses.get((group_id, angle_id))
+        if guess is None and group_id in self._guess_storages:
+            guess = np.array(self._guess_storages[group_id].read(group_id)[angle_id])
+        return guess
+
+    def release_angle_guesses(self, group_id, storage=None):
+        # Drops the angular fluxes of a solved group, its next solve starts
+        # from storage when that keeps them
+        for angle_id in range(self.num_angs):
+            self.guesses.pop((group_id, angle_id), None)
+        if storage is not None and storage.angular_fluxes is not None:
+            self._guess_storages[group_id] = storage
+
+    def keeps_angular_fluxes(self):
+        # Whether the angular fluxes of every group may be held in RAM
+        spec = self._storage_spec[0]
+        return spec in (None, 'memory') or isinstance(spec, InMemory)
+
+    def angle_lhs(self, group_id, angle_id):
+        # The operators of every angle of a group are built in one batch on
+        # the first miss, each is handed out once to be factored
+        with self._lhs_lock:
+            if (group_id, angle_id) not in self._pending_lhs:
+                for i, lhs in enumerate(self.op.make_lhs(self.angs, group_id)):
+                    self._pending_lhs[(group_id, i)] = lhs
+            return self._pending_lhs.pop((group_id, angle_id))
+
     def get_scalar_flux(self, group_id, source, phi_prev, ho_sols=None):
         scalar_flux = 0
-        if isinstance(self.op, Diffusion) or isinstance(self.op, NDA):
-            lhs = self.op.make_lhs(group_id, ho_sols=ho_sols).tocsr()
+        if isinstance(self.op, Diffusion):
+            rhs = self.op.make_rhs(group_id, source, phi_prev)
+            key = (self.op, group_id)
+            scalar_flux = self.linear_solver.solve(
+                lambda: self.op.make_lhs(group_id), rhs, key=key,
+                x0=self.guesses.get(group_id), tol=self.inner_tol(group_id))
+            self.guesses[group_id] = scalar_flux
+            return scalar_flux
+        elif isinstance(self.op, NDA):
+            # The drift closure changes with every high order solve
             rhs = self.op.make_rhs(group_id, source, phi_prev)
-            scalar_flux = linalg.cg(lhs, rhs)[0]
-            #scalar_flux = linalg.spsolve(lhs, rhs)
+            scalar_flux = self.linear_solver.solve(
+                lambda: self.op.make_lhs(group_id, ho_sols=ho_sols), rhs,
+                x0=self.guesses.get(group_id), tol=self.inner_tol(group_id))
+            self.guesses[group_id] = scalar_flux
             return scalar_flux
         else:
-            ang_fluxes = np.zeros((4, self.num_nodes))
-            # Iterate over all angle possibilities
-            for i, ang in enumerate(self.angs):
-                ang = np.array(ang)
-                ang_fluxes[i] = self.get_ang_flux(group_id, source, ang, i, phi_prev)
-                scalar_flux += self.weights[i] * ang_fluxes[i]
+            ang_fluxes = np.zeros((self.num_angs, self.num_nodes))
+            # The RHS of every angle at once, (num_angs, num_nodes)
+            rhs = self.op.make_rhs(group_id, source, self.angs, None, phi_prev)
+            def solve_angle(i):
+                ang_fluxes[i] = self.get_ang_flux(group_id, source, self.angs[i], i,
+                                                  phi_prev, rhs=rhs[i])
+            # The angles are independent given phi_prev, the threads share
+            # the operators and write to their own row of ang_fluxes
+            if self.angle_workers > 1:
+                list(self.angle_pool().map(telemetry.propagate(solve_angle),
+                                           range(self.num_angs)))
+            else:
+                for i in range(self.num_angs):
+                    solve_angle(i)
+            scalar_flux = self.weights @ ang_fluxes
             return scalar_flux, ang_fluxes
 
+    def check_materials(self):
+        # Cached operators and factorizations are dropped when the cross
+        # sections have changed since they were built
+        fingerprint = self.mat_data.fingerprint()
+        if fingerprint == self._mat_fingerprint:
+            return
+        self._mat_fingerprint = fingerprint
+        self.factorizations.clear()
+        for solver in (self.linear_solver, self.ua_linear_solver, self.block_linear_solver):
+            solver.clear()
+        with self._lhs_lock:
+            self._pending_lhs.clear()
+        if isinstance(self.op, NDA):
+            self.ho_solver.check_materials()
+
+    def get_angular_storage(self):
+        if self.angular_storage is None:
+            spec, path = self._storage_spec
+            self.angular_storage = get_storage(spec, self.quadrature, self.num_groups,
+                                               self.num_nodes, path)
+        return self.angular_storage
+
+    def angle_pool(self):
+        if self._angle_pool is None:
+            self._angle_pool = concurrent.futures.ThreadPoolExecutor(self.angle_workers)
+        return self._angle_pool
+
+    def group_pool(self):
+        if self._group_pool is None:
+            self._group_pool = concurrent.futures.ThreadPoolExecutor(self.group_workers)
+        return self._group_pool
+
+    def close(self):
+        # Stop the worker threads, they are started again when needed
+        if self._angle_pool is not None:
+            self._angle_pool.shutdown()
+            self._angle_pool = None
+        if self._group_pool is not None:
+            self._group_pool.shutdown()
+            self._group_pool = None
+        if isinstance(self.op, NDA):
+            self.ho_solver.close()
+        if self.angular_storage is not None:
+            self.angular_storage.close()
+            self.angular_storage = None
+
+    def linear_solver_stats(self):
+        solvers = {'linear_solver': self.linear_solver, 'ua': self.ua_linear_solver,
+                   'block': self.block_linear_solver}
+        if isinstance(self.op, NDA):
+            solvers['ho'] = self.ho_solver.linear_solver
+        return {name: {'solves': solver.num_solves, 'iterations': solver.iterations,
+                       'failures': getattr(solver, 'failures', 0)}
+                for name, solver in solvers.items()}
+
+    @contextlib.contextmanager
+    def collect(self):
+        # A fresh Telemetry for one solve, its SolveReport is kept in report
+        self.telemetry = Telemetry(self.timing, self.callbacks)
+        stats = self.linear_solver_stats()
+        hits, misses = self.factorizations.hits, self.factorizations.misses
+        start = time.perf_counter()
+        with self.telemetry.active():
+            yield self.telemetry
+        runtime = time.perf_counter() - start
+        # Counts of this solve only, the solvers keep totals
+        linear_solvers = {name: {stat: value - stats[name][stat]
+                                 for stat, value in totals.items()}
+                          for name, totals in self.linear_solver_stats().items()}
+        factorizations = {'hits': self.factorizations.hits - hits,
+                          'misses': self.factorizations.misses - misses}
+        setup = {'parse': self.op.fegrid.timings['parse'] + self.mat_data.timings['parse'],
+                 'geometry': self.op.fegrid.timings['geometry']}
+        self.report = self.telemetry.report(runtime, linear_solvers, factorizations, setup)
+
     def solve_in_group(self, source, group_id, phi_prev, max_iter=1000,
-                       tol=1e-6, verbose=True):
-        num_mats = self.mat_data.get_num_mats()
-        for mat in range(num_mats):
-            scatmat = self.mat_data.get_sigs(mat)
-            if np.count_nonzero(scatmat) == 0:
-                scattering = False
-            else:
-                scattering = True
+                       tol=1e-6, verbose=False):
+        scattering = self.has_scattering()
         if self.num_groups > 1 and verbose:
             print("Starting Group ", group_id)
+        self.residuals[group_id] = self.outer_residual
+        if scattering and self.inner == 'gmres':
+            return self.krylov_in_group(source, group_id, phi_prev, max_iter, tol, verbose)
         if isinstance(self.op, NDA):
             # Run preliminary solve on low-order system
             ho_sols = 0
@@ -69,8 +320,8 @@ class Solver():
             if scattering and verbose:
                 print("Within-Group Iteration: ", i)
             if isinstance(self.op, NDA):
-                ho_solver = Solver(self.ho_op)
-                ho_phis, ho_psis = ho_solver.get_scalar_flux(group_id, source, phi_prev)
+                self.ho_solver.residuals[group_id] = self.residuals[group_id]
+                ho_phis, ho_psis = self.ho_solver.get_scalar_flux(group_id, source, phi_prev)
                 ho_sols = [ho_phis, ho_psis]
                 phi = self.get_scalar_flux(group_id, source, phi_prev, ho_sols=ho_sols)
             elif isinstance(self.op, Diffusion):
@@ -81,11 +332,14 @@ class Solver():
                 break
             norm = np.linalg.norm(phi - phi_prev[group_id], float('inf'))/np.linalg.norm(phi, float('inf'))
             if verbose: print("Norm: ", norm)
+            self.residuals[group_id] = norm
+            self.telemetry.event('inner', i, norm, group=group_id)
             if norm < tol:
                 break
             phi_prev[group_id] = np.copy(phi)
-        if i == max_iter:
-            print("Warning: maximum number of iterations reached in solver")
+        else:
+            self.telemetry.warn("Maximum number of within-group iterations reached "
+                                "in group {}".format(group_id))
         if self.num_groups > 1 and verbose:
             print("Finished Group ", group_id)
         if scattering and verbose:
@@ -98,70 +352,288 @@ class Solver():
         else:
             return phi, ang_fluxes
 
-    def solve_outer(self, source, verbose=True, max_iter=50, tol=1e-5):
-        phis = np.ones((self.num_groups, self.num_nodes))
-        ang_fluxes = np.zeros((self.num_groups, 4, self.num_nodes))
+    def has_scattering(self):
+        # Whether any material scatters, not only the last one, the
+        # within-group iteration is skipped otherwise
+        return np.count_nonzero(self.mat_data.sig_s) != 0
+
+    def first_upscatter_group(self):
+        # Lowest group receiving upscatter, sig_s[m, g', g] != 0 for g' > g.
+        # The groups before it only depend on the groups above them.
+        upscatter = np.tril(self.mat_data.sig_s.any(axis=0), -1).any(axis=0)
+        return np.argmax(upscatter) if upscatter.any() else self.num_groups
+
+    def krylov_in_group(self, source, group_id, phi_prev, max_iter, tol, verbose):
+        # A transport sweep is affine in the group's own flux, phi = K phi + c,
+        # solve (I - K) phi = c with GMRES. K phi is a sweep without fixed
+        # source and scattering only from this group.
+        num_nodes = self.num_nodes
+        # Exact sweeps, an inexact K would change the operator GMRES sees
+        self.residuals[group_id] = 0.
+        others = np.copy(phi_prev)
+        others[group_id] = 0
+        c = self.get_scalar_flux(group_id, source, others)[0]
+        no_source = np.zeros_like(source)
+        scattered = np.zeros_like(phi_prev)
+        def matvec(phi):
+            scattered[group_id] = phi
+            return phi - self.get_scalar_flux(group_id, no_source, scattered)[0]
+        lhs = linalg.LinearOperator((num_nodes, num_nodes), matvec=matvec)
+        history = []
+        # maxiter counts restart cycles, max_iter bounds the sweeps as it
+        # does for source iteration, up to the end of the last cycle
+        restart = min(self.gmres_restart, max_iter)
+        phi, info = linalg.gmres(lhs, c, x0=phi_prev[group_id], rtol=tol, atol=0.,
+                                 restart=restart, maxiter=-(-max_iter // restart),
+                                 callback=history.append, callback_type='pr_norm')
+        self.krylov_residuals[group_id] = history
+        self.telemetry.event('krylov', len(history), history[-1] if history else 0.,
+                             group=group_id, history=history)
+        if info > 0:
+            self.telemetry.warn("Maximum number of GMRES iterations reached "
+                                "in group {}".format(group_id))
+        if verbose:
+            print("Number of GMRES Iterations: ", len(history))
+            if history:
+                print("Final Residual: ", history[-1])
+        # One more sweep for the angular fluxes
+        phi_prev[group_id] = phi
+        return self.get_scalar_flux(group_id, source, phi_prev)
+
+    def solve_block(self, source):
+        # Every group at once from the block system, no outer iteration
+        rhs = self.op.make_block_rhs(source)
+        phis = self.block_linear_solver.solve(
+            lambda: self.op.get_matrix("all"), rhs, key=(self.op, "all"))
+        return phis.reshape(self.num_groups, self.num_nodes)
+
+    def solve_outer(self, source, verbose=None, max_iter=50, tol=1e-5, phis=None):
+        if verbose is None:
+            verbose = self.verbose
+        self.check_materials()
+        if self.outer == 'block':
+            return self.solve_block(source)
+        if phis is None:
+            phis = np.ones((self.num_groups, self.num_nodes))
+        phis = np.array(phis, dtype=float)
+        # Angular fluxes of SAAF, and the high order ones of NDA when the
+        # upscatter acceleration needs them, are kept one group at a time
+        storage = None
+        if isinstance(self.op, SAAF) or (isinstance(self.op, NDA) and self.ua_bool):
+            storage = self.get_angular_storage()
+            if isinstance(self.op, NDA) and storage.angular_fluxes is None:
+                raise RuntimeError("Upscatter acceleration needs the high order angular fluxes")
+            storage.reset()
+        # Out of RAM, the initial guesses of the angles are only kept for
+        # the groups being solved
+        release = not self.keeps_angular_fluxes()
+        transport = self.ho_solver if isinstance(self.op, NDA) else self
+        transport._guess_storages.clear()
+        self.outer_residual = 1.
+        # The sweep over all groups is the fixed point map being accelerated
+        self.anderson = Anderson(self.anderson_depth) if self.anderson_depth > 0 else None
+        def store(g, result):
+            if isinstance(self.op, Diffusion):
+                phis[g] = result
+            elif isinstance(self.op, NDA):
+                phis[g], ho_sols = result
+                if storage is not None:
+                    storage.write(g, ho_sols[1])
+            else:
+                phis[g], ang_fluxes = result
+                storage.write(g, ang_fluxes)
+            if release and not isinstance(self.op, Diffusion):
+                transport.release_angle_guesses(g, storage)
+        # Gauss-Seidel over the groups without upscatter, the rest are
+        # solved together from the previous iterate when using Jacobi.
+        # The groups without upscatter do not depend on the rest, so with
+        # Jacobi they are only solved on the first iteration.
+        num_sweep = self.num_groups
+        if self.outer == 'jacobi':
+            if self.ua_bool:
+                raise RuntimeError("Upscatter acceleration requires Gauss-Seidel outer iterations")
+            num_sweep = self.first_upscatter_group()
         for it_count in range(max_iter):
             if self.num_groups != 1 and verbose:
-                print("Gauss-Seidel Iteration: ", it_count)
+                print("Outer Iteration: ", it_count)
             phis_prev = np.copy(phis)
-            if isinstance(self.op, NDA):
-                all_ho_sols = []
-            for g in range(self.num_groups):
-                if isinstance(self.op, Diffusion):
-                    phi = self.solve_in_group(source, g, phis, verbose=verbose)
-                    phis[g] = phi
-                elif isinstance(self.op, NDA):
-                    phi, ho_sols = self.solve_in_group(source, g, phis, verbose=verbose)
-                    phis[g] = phi
-                    all_ho_sols.append(ho_sols)
-                else:
-                    phi, psi = self.solve_in_group(source, g, phis)
-                    phis[g] = phi
-                    ang_fluxes[g] = psi
+            if self.outer == 'gauss-seidel' or it_count == 0:
+                for g in range(num_sweep):
+                    store(g, self.solve_in_group(source, g, phis, verbose=verbose))
+            if num_sweep < self.num_groups:
+                # Every group iterates on its own copy, only its row changes
+                start = np.copy(phis)
+                def solve_group(g):
+                    return self.solve_in_group(source, g, np.copy(start), verbose=verbose)
+                jacobi_groups = range(num_sweep, self.num_groups)
+                results = self.group_pool().map(telemetry.propagate(solve_group),
+                                                jacobi_groups)
+                for g, result in zip(jacobi_groups, results):
+                    store(g, result)
             if self.num_groups == 1:
                 break
             else:
                 if self.ua_bool:
                     # Calculate Correction Term
-                    print("Calculating Upscatter Acceleration Term")
-                    upscatter_accelerator = UA(self.op)
-                    # Calculate eigenfunctions
-                    eig_for_mat = np.zeros((self.num_mats, self.num_groups))
-                    for midx in range(self.num_mats):
-                        eig_for_mat[midx] = upscatter_accelerator.compute_eigenfunction(midx)
-                    eigs = np.zeros((self.num_groups, self.num_nodes))
-                    for g in range(self.num_groups):
-                        for elt in range(self.num_elts):
-                            e = self.op.fegrid.element(elt)
-                            midx = e.mat_id
-                            for n in range(3):
-                                n_global = self.op.fegrid.node(elt, n)
-                                nid = n_global.id
-                                eigs[g, nid] += eig_for_mat[midx, g]*1/3
-                    epsilon = upscatter_accelerator.calculate_correction(phis, phis_prev, all_ho_sols)
-                    phis += epsilon*eigs
+                    if verbose:
+                        print("Calculating Upscatter Acceleration Term")
+                    with telemetry.phase('ua'):
+                        upscatter_accelerator = UA(self.op, linear_solver=self.ua_linear_solver)
+                        # Calculate eigenfunctions
+                        eig_for_mat = np.zeros((self.num_mats, self.num_groups))
+                        for midx in range(self.num_mats):
+                            eig_for_mat[midx] = upscatter_accelerator.compute_eigenfunction(midx)
+                        # A third of every element's eigenfunction added to its nodes
+                        fegrid = self.op.fegrid
+                        to_nodes = assembly.element_source(fegrid, np.full((self.num_elts, 3), 1/3))
+                        eigs = (to_nodes @ eig_for_mat[fegrid.mat_ids]).T
+                        # High order solutions of every group, read back from storage
+                        all_ho_sols = [(self.weights @ psi, psi)
+                                       for psi in map(storage.read, range(self.num_groups))]
+                        epsilon = upscatter_accelerator.calculate_correction(phis, phis_prev, all_ho_sols)
+                        phis += epsilon*eigs
                 res = np.linalg.norm(phis - phis_prev, float('inf'))/np.linalg.norm(phis, float('inf'))
+                self.outer_residual = res
+                self.telemetry.event('outer', it_count, res)
                 if verbose:
-                    print("GS Norm: ", res)
+                    print("Outer Norm: ", res)
             if res < tol:
                 break
+            if self.anderson is not None:
+                phis[:] = self.anderson.update(phis_prev, phis)
         if isinstance(self.op, Diffusion) or isinstance(self.op, NDA):
             return phis
         else:
-            return phis, ang_fluxes
+            return phis, storage.angular_fluxes
 
-    def solve(self, source, ua_bool=False):
-        start = time.time()
+    def solve(self, source, ua_bool=False, verbose=None, report=False):
+        """Fixed source solve, returns the scalar fluxes and for SAAF the
+        angular fluxes, followed by the SolveReport with report."""
+        if verbose is None:
+            verbose = self.verbose
         if ua_bool:
+            if not isinstance(self.op, NDA):
+                raise RuntimeError("Upscatter acceleration is only implemented for NDA")
             self.ua_bool = True
-        if isinstance(self.op, Diffusion) or isinstance(self.op, NDA):
-            phis = self.solve_outer(source)
-            end = time.time()
-            print("Runtime:", np.round(end - start, 5), "seconds")
-            return phis
+        with self.collect():
+            result = self.solve_outer(source, verbose=verbose)
+        if verbose:
+            print("Runtime:", np.round(self.report.runtime, 5), "seconds")
+        if report:
+            if isinstance(result, tuple):
+                return result + (self.report,)
+            return result, self.report
+        return result
+
+    def fission_production(self, phis):
+        # nu sig_f phi summed over groups, from the element averaged fluxes,
+        # shape (num_elts,)
+        fegrid = self.op.fegrid
+        average = phis[:, fegrid.connectivity].mean(axis=2)
+        nu_sigf = self.mat_data.element_view(fegrid).nu_sigf
+        return np.einsum('eg,ge->e', nu_sigf, average)
+
+    def fission_source(self, production):
+        # Element-wise source of every group, chi[m, g] times the production
+        return self.mat_data.element_view(self.op.fegrid).chi.T * production
+
+    def solve_eigenvalue(self, max_iter=500, tol=1e-6, acceleration=None,
+                         shift=0.1, warmup=5, outer_iter=1, verbose=None, report=False):
+        """k-eigenvalue by power iteration on the fission source, solving
+        the fixed source problem with outer_iter outer iterations each
+        time. acceleration is None, 'chebyshev', which extrapolates the
+        fission source once the dominance ratio has been estimated over
+        warmup iterations, or for Diffusion 'wielandt', which solves the
+        block system shifted by k + shift. Returns k and the fluxes,
+        followed by the SolveReport with report."""
+        if acceleration not in (None, 'chebyshev', 'wielandt'):
+            raise RuntimeError("Unknown eigenvalue acceleration: " + str(acceleration))
+        if acceleration == 'wielandt' and not isinstance(self.op, Diffusion):
+            raise RuntimeError("Wielandt shifts are only implemented for Diffusion")
+        if verbose is None:
+            verbose = self.verbose
+        with self.collect():
+            result = self._power_iteration(max_iter, tol, acceleration, shift, warmup,
+                                           outer_iter, verbose)
+        if report:
+            return result + (self.report,)
+        return result
+
+    def _power_iteration(self, max_iter, tol, acceleration, shift, warmup, outer_iter,
+                         verbose):
+        areas = self.op.fegrid.areas
+        phis = np.ones((self.num_groups, self.num_nodes))
+        ang_fluxes = None
+        production = self.fission_production(phis)
+        k = 1.
+        # Fission source of the last two iterations and source changes, for
+        # the dominance ratio estimate and the Chebyshev recurrence
+        production_prev = None
+        changes = []
+        omega = None
+        start = 0
+        k_shift = None
+        for it in range(max_iter):
+            if acceleration == 'wielandt' and it >= warmup:
+                if k_shift is None:
+                    k_shift = k + shift
+                # (L - F/k_s) phi = (1/k - 1/k_s) F phi_prev, the shifted
+                # operator is factored once
+                rhs = self.op.make_block_rhs(self.fission_source(production)) * (1/k - 1/k_shift)
+                new_phis = self.block_linear_solver.solve(
+                    lambda: self.op.get_matrix("all") - self.op.get_fission_matrix() / k_shift,
+                    rhs, key=(self.op, "wielandt", k_shift))
+                new_phis = new_phis.reshape(self.num_groups, self.num_nodes)
+            else:
+                result = self.solve_outer(self.fission_source(production / k), verbose=verbose,
+                                          max_iter=outer_iter, phis=phis)
+                if isinstance(result, tuple):
+                    new_phis, ang_fluxes = result
+                else:
+                    new_phis = result
+            new_production = self.fission_production(new_phis)
+            # Eigenvalue update from the total fission production
+            ratio = (areas @ new_production) / (areas @ production)
+            if k_shift is None:
+                new_k = k * ratio
+            else:
+                new_k = 1 / (1/k_shift + (1/k - 1/k_shift) / ratio)
+            # Relative change of the normalized fission source
+            normalized = new_production / (areas @ new_production)
+            change = np.linalg.norm(normalized - production / (areas @ production), float('inf'))
+            change /= np.linalg.norm(normalized, float('inf'))
+            self.telemetry.event('power', it, change, k=new_k)
+            if verbose:
+                print("Power Iteration: ", it, " k: ", new_k, " Source Change: ", change)
+            phis = new_phis
+            k_change = abs(new_k - k) / new_k
+            k = new_k
+            if k_change < tol and change < tol:
+                break
+            changes.append(change)
+            if acceleration == 'chebyshev':
+                if omega is not None and changes[-1] > changes[-2]:
+                    # Extrapolation is not helping, estimate the ratio again
+                    omega = None
+                    start = it
+                if omega is None and it >= start + warmup and len(changes) > 1:
+                    # Dominance ratio from the decay of the source changes,
+                    # the recurrence starts with a plain step
+                    sigma = changes[-1] / changes[-2]
+                    if sigma < 1:
+                        omega = 1.
+                elif omega is not None:
+                    omega = 2 / (2 - sigma**2) if omega == 1 else 1 / (1 - sigma**2 * omega / 4)
+                    # s_n+1 = s_n-1 + omega (P s_n - s_n-1), kept non negative
+                    new_production = np.maximum(
+                        production_prev + omega * (new_production - production_prev), 0)
+                production_prev = production
+            production = new_production
         else:
-            phis, ang_fluxes = self.solve_outer(source)
-            end = time.time()
-            print("Runtime:", np.round(end - start, 5), "seconds")
-            return phis, ang_fluxes
+            self.telemetry.warn("Maximum number of power iterations reached")
+        self.power_iterations = it + 1
+        if verbose:
+            print("k-eigenvalue: ", k, " Power Iterations: ", it + 1)
+        if isinstance(self.op, SAAF):
+            return k, phis, ang_fluxes
+        return k, phis
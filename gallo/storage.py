@@ -0,0 +1,138 @@
+import abc
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+
+class AngularFluxStorage(abc.ABC):
+    def __init__(self, quadrature, num_groups, num_nodes):
+        """Angular fluxes of every group, written and read one group slab
+        of shape (num_angs, num_nodes) at a time. The current of every group,
+        shape (num_groups, 2, num_nodes), is kept by every backend."""
+        self.quadrature = quadrature
+        self.shape = (num_groups, quadrature.num_angs, num_nodes)
+        self.current = np.zeros((num_groups, 2, num_nodes))
+
+    def reset(self):
+        # Called before every outer iteration loop
+        self.current = np.zeros_like(self.current)
+
+    def write(self, group_id, ang_fluxes):
+        # Current sum_a w_a Omega_a psi_a of the group
+        q = self.quadrature
+        self.current[group_id] = (q.weights[:, None] * q.angs).T @ ang_fluxes
+
+    @abc.abstractmethod
+    def read(self, group_id):
+        pass
+
+    @property
+    def angular_fluxes(self):
+        # (num_groups, num_angs, num_nodes) array like, None if not kept
+        return None
+
+    def close(self):
+        pass
+
+
+class InMemory(AngularFluxStorage):
+    def __init__(self, quadrature, num_groups, num_nodes):
+        super().__init__(quadrature, num_groups, num_nodes)
+        self._psi = np.zeros(self.shape)
+
+    def reset(self):
+        # A new array, the caller may still hold the previous result
+        super().reset()
+        self._psi = np.zeros(self.shape)
+
+    def write(self, group_id, ang_fluxes):
+        super().write(group_id, ang_fluxes)
+        self._psi[group_id] = ang_fluxes
+
+    def read(self, group_id):
+        return self._psi[group_id]
+
+    @property
+    def angular_fluxes(self):
+        return self._psi
+
+
+def _remove_file(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class MemoryMapped(AngularFluxStorage):
+    def __init__(self, quadrature, num_groups, num_nodes, path=None):
+        """Angular fluxes in a .npy file at path, by default temporary files
+        removed on close or when the storage is garbage collected. Only the
+        slabs in use are paged in. Every solve gets a new temporary file,
+        like InMemory a new array, but a file at path is reused, so the
+        angular fluxes of a solve are overwritten by the next one."""
+        super().__init__(quadrature, num_groups, num_nodes)
+        self._temporary = path is None
+        self._finalizer = None
+        self.path = path
+        self._open()
+
+    def _open(self):
+        if self._temporary:
+            fd, self.path = tempfile.mkstemp(suffix='.npy', prefix='gallo-psi-')
+            os.close(fd)
+            self._finalizer = weakref.finalize(self, _remove_file, self.path)
+        self._psi = np.lib.format.open_memmap(self.path, mode='w+', dtype=float,
+                                              shape=self.shape)
+        self._written = False
+
+    def reset(self):
+        super().reset()
+        if self._temporary and self._written:
+            # The file of the last solve is removed, its map stays valid
+            self._finalizer()
+            self._open()
+
+    def write(self, group_id, ang_fluxes):
+        super().write(group_id, ang_fluxes)
+        self._psi[group_id] = ang_fluxes
+        self._written = True
+
+    def read(self, group_id):
+        return self._psi[group_id]
+
+    @property
+    def angular_fluxes(self):
+        # Read only, writes would go to the file
+        view = self._psi.view()
+        view.flags.writeable = False
+        return view
+
+    def close(self):
+        self._psi.flush()
+        if self._finalizer is not None:
+            # Open maps stay valid after the file is removed
+            self._finalizer()
+
+
+class MomentsOnly(AngularFluxStorage):
+    # Only the current is kept, the angular fluxes are dropped
+    def read(self, group_id):
+        raise RuntimeError("Angular fluxes are not kept in moments only storage")
+
+
+_STORAGES = {None: InMemory, 'memory': InMemory, 'memmap': MemoryMapped,
+             'moments': MomentsOnly}
+
+
+def get_storage(spec, quadrature, num_groups, num_nodes, path=None):
+    """Storage from an AngularFluxStorage or one of the names 'memory' (the
+    default), 'memmap', a file at path, and 'moments', which keeps only the
+    current."""
+    if isinstance(spec, AngularFluxStorage):
+        return spec
+    if spec not in _STORAGES:
+        raise RuntimeError("Unknown angular flux storage: " + str(spec))
+    if spec == 'memmap':
+        return MemoryMapped(quadrature, num_groups, num_nodes, path)
+    return _STORAGES[spec](quadrature, num_groups, num_nodes)
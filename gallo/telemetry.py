@@ -0,0 +1,190 @@
+import collections
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+import warnings
+from typing import Dict, List, Optional
+
+import attr
+
+# Telemetry of the solve in progress in this thread (or task), None
+# outside of a solve. Worker threads get it through propagate().
+_active = contextvars.ContextVar('active_telemetry', default=None)
+_NULL = contextlib.nullcontext()
+
+
+class ConvergenceWarning(RuntimeWarning):
+    pass
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class Event:
+    # 'inner' (within-group iteration), 'krylov' (GMRES within-group
+    # solve), 'outer' or 'power' (power iteration)
+    kind: str
+    iteration: int
+    residual: float
+    group: Optional[int] = None
+    k: Optional[float] = None
+
+
+@attr.s(slots=True, frozen=True, auto_attribs=True)
+class SolveReport:
+    # Wall time of the solve in seconds
+    runtime: float
+    # Seconds spent in each phase, exclusive of nested phases and summed
+    # over threads, and the number of times each phase was entered
+    timers: Dict[str, float]
+    calls: Dict[str, int]
+    outer_residuals: List[float]
+    # Within-group residuals of every group, over all outer iterations
+    inner_residuals: Dict[int, List[float]]
+    krylov_residuals: Dict[int, List[float]]
+    # k after every power iteration
+    eigenvalues: List[float]
+    # Solves, iterations and failures of each linear solver during the solve
+    linear_solvers: Dict[str, Dict[str, int]]
+    # Factorization cache hits and misses during the solve
+    factorizations: Dict[str, int]
+    # Parse and geometry times of the mesh and materials, spent once
+    # before any solve
+    setup: Dict[str, float]
+    # Messages of the ConvergenceWarnings of the solve
+    warnings: List[str]
+
+    @property
+    def outer_iterations(self):
+        return len(self.outer_residuals)
+
+    @property
+    def inner_iterations(self):
+        return {g: len(res) for g, res in self.inner_residuals.items()}
+
+
+class Telemetry():
+    def __init__(self, timing=False, callbacks=()):
+        """Residual histories and events of a solve, passed to every callback
+        as they happen. While active(), the warnings of warn() are collected
+        and with timing, the phases entered through phase() or functions
+        decorated with timed() are timed."""
+        self.timing = timing
+        self.callbacks = list(callbacks)
+        self.timers = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.outer_residuals = []
+        self.inner_residuals = collections.defaultdict(list)
+        self.krylov_residuals = {}
+        self.eigenvalues = []
+        self.warnings = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def active(self):
+        token = _active.set(self)
+        try:
+            yield self
+        finally:
+            _active.reset(token)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        # Time spent in nested phases is not counted twice
+        stack = self._local.__dict__.setdefault('stack', [])
+        stack.append(0.)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.timers[name] += elapsed - nested
+                self.calls[name] += 1
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            self.timers[name] += seconds
+            self.calls[name] += 1
+
+    def event(self, kind, iteration, residual, group=None, k=None, history=None):
+        with self._lock:
+            if kind == 'inner':
+                self.inner_residuals[group].append(residual)
+            elif kind == 'krylov':
+                self.krylov_residuals[group] = list(history)
+            elif kind == 'outer':
+                self.outer_residuals.append(residual)
+            elif kind == 'power':
+                self.eigenvalues.append(k)
+        if self.callbacks:
+            event = Event(kind, iteration, residual, group, k)
+            for callback in self.callbacks:
+                callback(event)
+
+    def warn(self, message, stacklevel=2):
+        # stacklevel as for warnings.warn, from the caller
+        with self._lock:
+            self.warnings.append(message)
+        warnings.warn(message, ConvergenceWarning, stacklevel=stacklevel + 1)
+
+    def report(self, runtime, linear_solvers, factorizations, setup):
+        return SolveReport(runtime, dict(self.timers), dict(self.calls),
+                           list(self.outer_residuals),
+                           {g: list(res) for g, res in self.inner_residuals.items()},
+                           dict(self.krylov_residuals), list(self.eigenvalues),
+                           linear_solvers, factorizations, setup, list(self.warnings))
+
+
+def active():
+    # Telemetry of the solve in progress in this thread, None outside of one
+    return _active.get()
+
+
+def phase(name):
+    # Context timing name in the active telemetry, a no-op otherwise
+    record = _active.get()
+    if record is None or not record.timing:
+        return _NULL
+    return record.phase(name)
+
+
+def warn(message, stacklevel=2):
+    # ConvergenceWarning, also kept in the report of the active telemetry
+    record = _active.get()
+    if record is None:
+        warnings.warn(message, ConvergenceWarning, stacklevel=stacklevel + 1)
+    else:
+        record.warn(message, stacklevel + 1)
+
+
+def propagate(func):
+    # func run with the telemetry active in the calling thread, for tasks
+    # handed to worker threads
+    record = _active.get()
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _active.set(record)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _active.reset(token)
+    return wrapper
+
+
+def timed(name):
+    # Decorator timing every call as phase name
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            record = _active.get()
+            if record is None or not record.timing:
+                return func(*args, **kwargs)
+            with record.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,172 +1,77 @@
 import numpy as np
-import scipy.sparse as sps
-import scipy.sparse.linalg as linalg
+
+from gallo import assembly, telemetry
+from gallo.linear_solvers import get_linear_solver
 
 class UA():
-    def __init__(self, operator):
+    def __init__(self, operator, linear_solver='gmres+ilu'):
         self.op = operator
+        # The drift term makes the correction operator nonsymmetric
+        self.linear_solver = get_linear_solver(linear_solver)
         self.fegrid = self.op.fegrid
         self.mat_data = self.op.mat_data
         self.num_nodes = self.fegrid.num_nodes
         self.num_groups = self.mat_data.get_num_groups()
         self.num_elts = self.fegrid.num_elts
         self.num_gnodes = self.fegrid.num_gauss_nodes
+        # Element matrices of the correction operator
+        self.stiffness = assembly.stiffness(self.fegrid)
+        self.mass = assembly.mass(self.fegrid)
+        self.mass_matrices = self.fegrid.pattern.material_matrices(
+            self.mass, self.fegrid.mat_ids, self.mat_data.get_num_mats())
 
     def calculate_correction(self, phis, phis_prev, ho_sols):
-        lhs = self.correction_lhs(ho_sols)
         rhs = self.correction_rhs(phis, phis_prev)
-        correction = linalg.cg(lhs, rhs)[0]
+        correction = self.linear_solver.solve(lambda: self.correction_lhs(ho_sols), rhs)
         return correction
 
+    @telemetry.timed('assembly')
     def correction_lhs(self, ho_sols):
-        sparse_matrix = sps.lil_matrix((self.num_nodes, self.num_nodes))
-        ho_phi = np.array([ho_sols[g][0] for g in range(self.num_groups)])
-        ho_psi = np.array([ho_sols[g][1] for g in range(self.num_groups)])
-        # Interpolate Phi
-        triang = self.fegrid.setup_triangulation()
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            midx = elt.mat_id
-            eigs = self.compute_eigenfunction(midx)
-            diffs = np.array([self.mat_data.get_diff(midx, g)*eigs[g] for g in range(self.num_groups)])
-            D = np.sum(diffs)
-            sig_a = self.compute_absorption(midx, eigs)
-            inv_sigt = np.array([self.mat_data.get_inv_sigt(midx, g) for g in range(self.num_groups)])
-            # Determine basis functions for element
-            coef = self.fegrid.basis(e)
-            # Determine Gauss Nodes for element
-            g_nodes = self.fegrid.gauss_nodes(e)
-            # Find Phi at Gauss Nodes
-            phi_vals = self.fegrid.phi_at_gauss_nodes(triang, ho_phi, g_nodes)
-            # Find Psi at Gauss Nodes
-            psi_vals = np.array([self.fegrid.phi_at_gauss_nodes(triang, ho_psi[:, i], g_nodes) for i in range(4)])
-            for n in range(3):
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i])
-                    for i in range(self.num_gnodes)])
-                n_global = self.fegrid.node(e, n)
-                for ns in range(3):
-                    # Coefficients of basis function
-                    bns = coef[:, ns]
-                    # Array of values of basis function evaluated at gauss nodes
-                    fns_vals = np.array([self.fegrid.evaluate_basis_function(bns, g_nodes[i])
-                        for i in range(self.num_gnodes)])
-                    ns_global = self.fegrid.node(e, ns)
-                    # Get node IDs
-                    nid = n_global.id
-                    nsid = ns_global.id
-                    # Calculate gradients
-                    ngrad = self.fegrid.gradient(e, n)
-                    nsgrad = self.fegrid.gradient(e, ns)
-
-                    # Integrate for A (basis function derivatives)
-                    area = self.fegrid.element_area(e)
-                    inprod = np.dot(ngrad, nsgrad)
-                    A = D * area * inprod
-
-                    # Integrate for B (basis functions multiplied)
-                    integral = self.fegrid.gauss_quad(e, fn_vals*fns_vals)
-                    C = sig_a * integral
-
-                    # Calculate drift_vector
-                    drift_vector = np.zeros((self.num_gnodes, 2))
-                    for g in range(self.num_groups):
-                        drift_vector += self.op.compute_drift_vector(inv_sigt[g],
-                                                diffs[g], ngrad, phi_vals[g],
-                                                psi_vals[:, g])*eigs[g]
-
-                    # Integrate drift_vector@gradient*basis_function
-                    integral = self.fegrid.gauss_quad(e, (drift_vector@ngrad)*fn_vals)
-                    E = integral
+        pattern = self.fegrid.pattern
+        # Eigenfunction weighted cross sections only depend on the material
+        num_mats = self.mat_data.get_num_mats()
+        mat_eigs = [self.compute_eigenfunction(midx) for midx in range(num_mats)]
+        mat_diff = np.einsum('mg,mg->m', self.mat_data.D, mat_eigs)
+        mat_siga = np.array([self.compute_absorption(midx, mat_eigs[midx])
+                             for midx in range(num_mats)])
+        midx = self.fegrid.mat_ids
+        # Integrate for A (basis function derivatives) and C (basis functions multiplied)
+        local = (mat_diff[midx, None, None] * self.stiffness
+                 + mat_siga[midx, None, None] * self.mass)
+        # Eigenfunction weighted sum of the group drift tensors
+        xs = self.mat_data.element_view(self.fegrid)
+        eigs = np.array(mat_eigs)[midx]
+        diffs = xs.D * eigs
+        inv_sigt = xs.inv_sigt
+        tensor = np.zeros((self.num_elts, self.num_gnodes, 2, 2))
+        for g in range(self.num_groups):
+            closure = self.op.compute_closure(ho_sols[g])
+            tensor += eigs[:, g, None, None, None] * (
+                inv_sigt[:, g, None, None, None] * closure.second_moment
+                - (diffs[:, g, None] * closure.zeroth_moment)[:, :, None, None] * np.eye(2))
+        local += self.op.drift_local(tensor)
+        data = pattern.scatter(local)
+        data += self.boundary_data()
+        return pattern.matrix(data)
 
-                    sparse_matrix[nid, nsid] += A + C + E
-                    if not n_global.is_interior and not ns_global.is_interior:
-                        # Assign boundary id, marks end of region along
-                        # boundary where basis function is nonzero
-                        bid = nsid
-                        # Figure out what boundary you're on
-                        if (nid == nsid) and (self.fegrid.is_corner(nid)):
-                            # If on a corner, figure out what normal we should use
-                            verts = self.fegrid.boundary_nonzero(nid, e)
-                            if verts == -1:  # Means the whole element is a corner
-                                # We have to calculate boundary integral twice,
-                                # once for each other vertex
-                                # Find the other vertices
-                                all_verts = np.array(self.fegrid.element(e).vertices)
-                                vert_local_idx = np.where(all_verts == nid)[0][0]
-                                other_verts = np.delete(all_verts, vert_local_idx)
-                                # Calculate boundary integrals for other vertices
-                                for vtx in other_verts:
-                                    bid = vtx
-                                    xis = self.fegrid.gauss_nodes1d([nid, bid], e)
-                                    basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                                    boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                                    sparse_matrix[nid,nsid] += boundary_integral
-                                continue
-                            else:
-                                bid = verts[1]
-                        # Check to make sure you're on a boundary
-                        normal = self.fegrid.assign_normal(nid, bid)
-                        if isinstance(normal, int):
-                            continue
-                        # Get Gauss Nodes for the element
-                        xis = self.fegrid.gauss_nodes1d([nid, bid], e)
-                        basis_product = self.fegrid.boundary_basis_product(nid, bid, xis, bn, bns, e)
-                        boundary_integral = self.fegrid.gauss_quad1d(basis_product, [nid, bid], e)
-                        sparse_matrix[nid, nsid] += boundary_integral
-        return sparse_matrix
+    def boundary_data(self):
+        local = assembly.boundary_mass(self.fegrid)
+        return self.fegrid.pattern.scatter_at(self.fegrid.boundary_map, local)
 
+    @telemetry.timed('rhs')
     def correction_rhs(self, phis, phis_prev):
+        # Upscattering source of the last iteration's change in flux,
+        # sum_m M_m sum_g sum_g'>g sig_s[m, g', g] (phi_g' - phi_prev_g')
+        upscatter = np.tril(self.mat_data.sig_s, -1).sum(axis=2)
+        change = upscatter @ (phis - phis_prev)
         rhs_at_node = np.zeros(self.num_nodes)
-        triang = self.fegrid.setup_triangulation()
-        for e in range(self.num_elts):
-            elt = self.fegrid.element(e)
-            midx = elt.mat_id
-            coef = self.fegrid.basis(e)
-            g_nodes = self.fegrid.gauss_nodes(e)
-            for n in range(3):
-                n_global = self.fegrid.node(e, n)
-                # Coefficients of basis functions b[0] + b[1]x + b[2]y
-                bn = coef[:, n]
-                # Array of values of basis function evaluated at interior gauss nodes
-                fn_vals = np.array([self.fegrid.evaluate_basis_function(bn, g_nodes[i]) for i in range(self.num_gnodes)])
-                # Get node ids
-                nid = n_global.id
-
-                # Subtract Phi Prevs
-                # Find Phi at Gauss Nodes
-                phi_vals = self.fegrid.phi_at_gauss_nodes(triang, phis_prev, g_nodes)
-                # Multiply Phi & Basis Function
-                product = fn_vals * phi_vals
-                integral = np.array([self.fegrid.gauss_quad(e, product[g]) for g in range(self.num_groups)])
-                ssource = np.sum(np.array([self.partial_scat(midx, integral, g) for g in range(self.num_groups)]))
-                rhs_at_node[nid] -= ssource
-
-                # Add Phi Prevs
-                # Find Phi at Gauss Nodes
-                phi_vals = self.fegrid.phi_at_gauss_nodes(triang, phis, g_nodes)
-                # Multiply Phi & Basis Function
-                product = fn_vals * phi_vals
-                integral = np.array([self.fegrid.gauss_quad(e, product[g]) for g in range(self.num_groups)])
-                ssource = np.sum(np.array([self.partial_scat(midx, integral, g) for g in range(self.num_groups)]))
-                rhs_at_node[nid] += ssource
-
+        for midx, mass in enumerate(self.mass_matrices):
+            rhs_at_node += mass @ change[midx]
         return rhs_at_node
 
-    def partial_scat(self, midx, phi, group_id):
-        scatmat = self.mat_data.get_sigs(midx)
-        ssource = 0
-        for g_prime in range(group_id+1, self.num_groups):
-            if g_prime != group_id:
-                ssource += scatmat[g_prime, group_id]*phi[g_prime]
-        return ssource
-
     def compute_eigenfunction(self, midx, eig_vals=False):
-        scatmat = np.transpose(self.mat_data.get_sigs(midx))
-        all_sigts = np.array([self.mat_data.get_sigt(midx, g) for g in range(self.num_groups)])
-        T = np.diag(all_sigts)
+        scatmat = np.transpose(self.mat_data.sig_s[midx])
+        T = np.diag(self.mat_data.sig_t[midx])
         SL = np.tril(scatmat, -1)
         SU = np.triu(scatmat, 1)
         SD = np.diag(np.diag(scatmat))
@@ -183,14 +88,8 @@ class UA():
         return eigenfunction.real
 
     def compute_absorption(self, midx, eigs):
-        # Compute sig_a
-        scatmat = self.mat_data.get_sigs(midx)
-        sig_a = np.zeros(self.num_groups)
-        for g in range(self.num_groups):
-            sig_r = self.mat_data.get_sigr(midx, g)
-            sig_s = 0
-            for g_prime in range(self.num_groups):
-                if g_prime != g:
-                    sig_s += scatmat[g_prime, g]*eigs[g_prime]
-            sig_a[g] = sig_r*eigs[g] - sig_s
-        return np.sum(sig_a)
+        # Eigenfunction weighted removal minus scattering in from the other
+        # groups, summed over groups
+        scatmat = self.mat_data.sig_s[midx]
+        inscatter = (scatmat.sum(axis=1) - np.diag(scatmat)) @ eigs
+        return self.mat_data.sig_r[midx] @ eigs - inscatter
@@ -0,0 +1,36 @@
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo.anderson import Anderson
+
+class TestAnderson:
+    @classmethod
+    def setup_class(cls):
+        # Slowly converging linear fixed point x = A x + b
+        rng = np.random.default_rng(0)
+        q = np.linalg.qr(rng.random((20, 20)))[0]
+        cls.A = q @ np.diag(np.linspace(0.5, 0.95, 20)) @ q.T
+        cls.b = rng.random(20)
+        cls.x = np.linalg.solve(np.eye(20) - cls.A, cls.b)
+
+    def iterations(self, mixer, tol=1e-8):
+        x = np.zeros(20)
+        for it in range(1000):
+            gx = self.A @ x + self.b
+            if np.linalg.norm(gx - x) < tol:
+                return it, gx
+            x = gx if mixer is None else mixer.update(x, gx)
+
+    def test_acceleration(self):
+        plain, x_plain = self.iterations(None)
+        mixed, x_mixed = self.iterations(Anderson(depth=5))
+        assert_allclose(x_mixed, self.x, rtol=1e-6)
+        ok_(mixed < plain / 4)
+
+    def test_safeguard(self):
+        mixer = Anderson(depth=2)
+        mixer.update(np.zeros(3), np.ones(3))
+        # A residual larger than the last one drops the history
+        eq_(list(mixer.update(np.ones(3), 5*np.ones(3))), [5, 5, 5])
+        eq_(mixer.restarts, 1)
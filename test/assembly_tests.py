@@ -0,0 +1,49 @@
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo import assembly
+from gallo.fe import FEGrid
+
+class TestAssembly:
+    @classmethod
+    def setup_class(cls):
+        cls.nodefile = "test/test_inputs/std3.node"
+        cls.elefile = "test/test_inputs/std3.ele"
+        cls.fegrid = FEGrid(cls.nodefile, cls.elefile)
+        cls.pattern = cls.fegrid.pattern
+
+    def test_scatter(self):
+        local = np.random.RandomState(0).rand(self.fegrid.num_elts, 3, 3)
+        dense = np.zeros((self.fegrid.num_nodes, self.fegrid.num_nodes))
+        for e, verts in enumerate(self.fegrid.connectivity):
+            dense[np.ix_(verts, verts)] += local[e]
+        assert_allclose(self.pattern.assemble(local).toarray(), dense)
+
+    def test_locate(self):
+        # Nodes 0 and 1 are opposite corners and share no element
+        assert_raises(RuntimeError, self.pattern.locate, [0], [1])
+        pos = self.pattern.locate([4], [4])
+        eq_(self.pattern.indices[pos[0]], 4)
+
+    def test_local_matrices(self):
+        mass = assembly.mass(self.fegrid)
+        # Consistent mass matrix of a P1 triangle
+        ref = self.fegrid.areas[0]/12*np.array([[2, 1, 1], [1, 2, 1], [1, 1, 2]])
+        assert_allclose(mass[0], ref)
+        # Rows of the stiffness matrix sum to zero
+        assert_allclose(assembly.stiffness(self.fegrid).sum(axis=2), 0, atol=1e-12)
+
+    def test_material_operators(self):
+        # A single material, the operators are the assembled K and M
+        ops = assembly.MaterialOperators(self.fegrid, 1)
+        stiffness = self.pattern.assemble(assembly.stiffness(self.fegrid))
+        mass = self.pattern.assemble(assembly.mass(self.fegrid))
+        data = ops.diffusion_data(np.array([2.]), np.array([3.]))
+        assert_allclose(self.pattern.matrix(data).toarray(),
+                        (2*stiffness + 3*mass).toarray(), atol=1e-12)
+        # Scattering in from group 1 only, the within-group term is skipped
+        sig_s = np.array([[[5., 0.], [7., 0.]]])
+        phi = np.ones((2, self.fegrid.num_nodes))
+        source = np.zeros((2, self.fegrid.num_elts))
+        assert_allclose(ops.group_source(sig_s, 0, source, phi), 7 * mass @ phi[1])
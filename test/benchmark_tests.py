@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+
+from nose.tools import *
+from numpy.testing import *
+
+from gallo import benchmark
+
+class TestBenchmark:
+    @classmethod
+    def setup_class(cls):
+        cls.results = benchmark.run(['parse', 'geometry', 'outer-diffusion'],
+                                    sizes=[100, 400], repeat=1, verbose=False)
+
+    def test_run(self):
+        eq_(len(self.results), 6)
+        for result in self.results:
+            ok_(result['best'] > 0)
+            ok_(result['peak_bytes'] > 0)
+        eq_(set(benchmark.scaling(self.results)), {'parse', 'geometry', 'outer-diffusion'})
+
+    def test_limits(self):
+        results = benchmark.run(['ua-nda'], sizes=[10**5], verbose=False)
+        eq_(results, [])
+
+    def test_compare(self):
+        # As read back from a file
+        baseline = json.loads(json.dumps(benchmark.report(self.results)))
+        comparisons = benchmark.compare(self.results, baseline)
+        eq_(len(comparisons), 6)
+        ok_(not any(entry['regression'] for entry in comparisons))
+        # Everything twice as fast in the baseline
+        for result in baseline['results']:
+            result['best'] /= 2
+        comparisons = benchmark.compare(self.results, baseline)
+        ok_(all(entry['regression'] for entry in comparisons))
+        assert_allclose([entry['time_ratio'] for entry in comparisons], 2.)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "bench.json")
+            args = ['--cases', 'geometry', '--sizes', '100', '--repeat', '1']
+            eq_(benchmark.main(args + ['--output', output]), 0)
+            with open(output) as f:
+                eq_(json.load(f)['results'][0]['case'], 'geometry')
+            # Nothing can regress by more than a factor of 1e6
+            eq_(benchmark.main(args + ['--baseline', output, '--threshold', '1e6']), 0)
+
+    @raises(RuntimeError)
+    def unknown_case_test(self):
+        benchmark.run(['sweep'], sizes=[100])
@@ -14,7 +14,7 @@ def to_problem(mesh, mat, filename):
     nodefile = "../test_inputs/" + mesh + ".node"
     elefile = "../test_inputs/" + mesh + ".ele"
     matfile = "../test_inputs/" + mat + ".mat"
-    grid = FEGrid(nodefile, elefile)
+    grid = FEGrid(nodefile, elefile, cache=True)
     mats = Materials(matfile)
     op = Diffusion(grid, mats)
     solver = Solver(op)
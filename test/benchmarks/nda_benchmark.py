@@ -16,7 +16,7 @@ def to_problem(mesh, mat, filename):
     nodefile = "../test_inputs/" + mesh + ".node"
     elefile = "../test_inputs/" + mesh + ".ele"
     matfile = "../test_inputs/" + mat + ".mat"
-    grid = FEGrid(nodefile, elefile)
+    grid = FEGrid(nodefile, elefile, cache=True)
     mats = Materials(matfile)
     n_elements = grid.num_elts
     num_groups = mats.get_num_groups()
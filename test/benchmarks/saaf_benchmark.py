@@ -17,7 +17,7 @@ def to_problem(mesh, mats, filename):
     elefile = "../test_inputs/" + mesh + ".ele"
     matfile = "../test_inputs/" + mats + ".mat"
     print(matfile)
-    grid = FEGrid(nodefile, elefile)
+    grid = FEGrid(nodefile, elefile, cache=True)
     mats = Materials(matfile)
     op = SAAF(grid, mats)
     solver = Solver(op)
@@ -46,7 +46,7 @@ def test_problem(problem):
         scalar_flux = phis[g]
         plot(problem.grid, scalar_flux, problem.filename + "_scalar_flux" + "_group" + str(g))
         ang_fluxes = angs[g]
-        for i in range(4):
+        for i in range(problem.op.num_angs):
             plot(problem.grid, ang_fluxes[i], problem.filename + "_ang" + str(i) + "_group" + str(g))
 
 @filename_to_problem
@@ -123,17 +123,17 @@ def plot_mats(problem):
 @filename_to_problem
 def plot_from_file(problem):
     phis = np.zeros((problem.num_groups, problem.n_nodes))
-    angs = np.zeros((problem.num_groups, 4, problem.n_nodes))
+    angs = np.zeros((problem.num_groups, problem.op.num_angs, problem.n_nodes))
     for g in range(problem.num_groups):
         phis[g] = np.loadtxt("scalar_flux" + str(g))
-        for i in range(4):
+        for i in range(problem.op.num_angs):
             angs[g, i] = np.loadtxt("angular_flux_ang" + str(i) + "_group" + str(g))
 
     for g in range(problem.num_groups):
         scalar_flux = phis[g]
         plot(problem.grid, scalar_flux, problem.filename + "_scalar_flux" + "_group" + str(g))
         ang_fluxes = angs[g]
-        for i in range(4):
+        for i in range(problem.op.num_angs):
             plot(problem.grid, ang_fluxes[i], problem.filename + "_ang" + str(i) + "_group" + str(g))
 
 test_problem("symmetric", "scattering1g", "saaf_1gscat")
@@ -3,6 +3,7 @@ import numpy as np
 import scipy.sparse as sps
 import scipy.sparse.linalg as linalg
 
+from gallo import assembly
 from gallo.formulations.diffusion import Diffusion
 from gallo.fe import FEGrid
 from gallo.materials import Materials
@@ -22,3 +23,30 @@ class TestDiffusion():
         A = self.operator.make_lhs(0)
         assert (A!=A.transpose()).nnz==0
         assert (A.diagonal() >= 0).all()
+
+    def test_material_split(self):
+        # Weighted per material matrices match direct element assembly
+        grid = self.fegrid
+        midx = grid.mat_ids
+        D = self.materials.D[midx, 0]
+        sig_r = np.array([self.materials.get_sigr(m, 0) for m in midx])
+        local = (D[:, None, None]*assembly.stiffness(grid)
+                 + sig_r[:, None, None]*assembly.mass(grid))
+        direct = grid.pattern.assemble(local) + grid.pattern.matrix(self.operator.boundary_data())
+        A = self.operator.make_lhs(0)
+        assert abs(A - direct).max() < 1e-12
+
+    def test_block_matrix(self):
+        # Block rows of the all group system are the group operators minus
+        # the scattering from the other groups
+        mats = Materials("test/test_inputs/3gtest.mat")
+        grid = FEGrid("test/test_inputs/std3.node", "test/test_inputs/std3.ele")
+        op = Diffusion(grid, mats)
+        G, N = mats.num_groups, grid.num_nodes
+        A = op.get_matrix("all")
+        eq_(A.shape, (G*N, G*N))
+        phis = np.random.default_rng(0).random((G, N))
+        source = np.zeros((G, grid.num_elts))
+        for g in range(G):
+            row = op.make_lhs(g) @ phis[g] - op.make_rhs(g, source, phis)
+            assert np.allclose((A @ phis.ravel())[g*N:(g+1)*N], row)
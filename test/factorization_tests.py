@@ -0,0 +1,43 @@
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+import scipy.sparse as sps
+
+from gallo.factorization import FactorizationCache
+
+class TestFactorizationCache:
+    @classmethod
+    def setup_class(cls):
+        cls.lhs = sps.diags([-1, 4, -1], [-1, 0, 1], shape=(10, 10), format='csr')
+        cls.calls = 0
+
+    def make_lhs(self):
+        self.calls += 1
+        return self.lhs
+
+    def test_reuse(self):
+        cache = FactorizationCache()
+        rhs = np.ones(10)
+        x = cache.solve("a", self.make_lhs, rhs)
+        assert_allclose(self.lhs @ x, rhs)
+        calls = self.calls
+        cache.solve("a", self.make_lhs, 2*rhs)
+        eq_(self.calls, calls)
+        eq_((cache.hits, cache.misses), (1, 1))
+
+    def test_lru_eviction(self):
+        cache = FactorizationCache()
+        cache.get("a", self.make_lhs)
+        cache.max_bytes = 2*cache.nbytes
+        cache.get("b", self.make_lhs)
+        # Touch "a" so that "b" is the least recently used entry
+        cache.get("a", self.make_lhs)
+        cache.get("c", self.make_lhs)
+        ok_("a" in cache and "c" in cache)
+        ok_("b" not in cache)
+        ok_(cache.nbytes <= cache.max_bytes)
+
+    def test_over_budget(self):
+        cache = FactorizationCache(max_bytes=0)
+        cache.solve("a", self.make_lhs, np.ones(10))
+        eq_(len(cache), 0)
@@ -1,7 +1,11 @@
+import os
+import tempfile
+
 from nose.tools import *
 from numpy.testing import *
 import numpy as np
 
+from gallo import cache, parse
 from gallo.fe import FEGrid
 
 class TestFe:
@@ -94,3 +98,114 @@ class TestFe:
     def test_centroid(self):
         eq_(self.stdgrid.centroid(0)[0], 1/3)
         eq_(self.stdgrid.centroid(0)[1], 1/3)
+
+    def test_tables(self):
+        num_elts = self.fegrid.num_elts
+        eq_(self.fegrid.connectivity.shape, (num_elts, 3))
+        eq_(self.fegrid.gradients.shape, (num_elts, 3, 2))
+        eq_(self.fegrid.gauss_table().shape, (num_elts, 4, 2))
+        assert_allclose(self.fegrid.areas.sum(), 1)
+        assert_array_equal(self.stdgrid.gauss_nodes(1, ord=2),
+                           self.stdgrid.gauss_table(2)[1])
+        ok_(not self.fegrid.basis_coefs.flags.writeable)
+
+    def test_boundary_table(self):
+        # Unit square, the boundary edges cover the perimeter once
+        assert_allclose(self.fegrid.boundary_lengths.sum(), 4)
+        for verts, normal in zip(self.fegrid.boundary_verts,
+                                 self.fegrid.boundary_normals):
+            assert_array_equal(self.fegrid.assign_normal(*verts), normal)
+        gauss = self.fegrid.boundary_gauss
+        eq_(gauss.shape, (len(self.fegrid.boundary_elts), 2, 2))
+
+    def test_values_at_gauss_nodes(self):
+        # Linear fields are interpolated exactly
+        x, y = self.fegrid.positions.T
+        phi = np.array([x + 2*y, 3 - y])
+        vals = self.fegrid.values_at_gauss_nodes(phi)
+        gx, gy = self.fegrid.gauss_table().transpose(2, 0, 1)
+        assert_allclose(vals[0], gx + 2*gy)
+        assert_allclose(vals[1], 3 - gy)
+
+    def test_lazy_objects(self):
+        grid = FEGrid(self.stdnode, self.stdele)
+        node, element = grid.node(1), grid.element(1)
+        ok_(grid._nodes is None and grid._elts_list is None)
+        eq_(grid.nodes[1], node)
+        eq_(grid.elts_list[1], element)
+        eq_(grid.node(1, 2), grid.nodes[element.vertices[2]])
+
+    def test_comments(self):
+        nodes, elts = parse.parse_nodes(self.stdnode)[0], parse.parse_elts(self.stdele)
+        with tempfile.TemporaryDirectory() as tmp:
+            node_file = os.path.join(tmp, "mesh.node")
+            ele_file = os.path.join(tmp, "mesh.ele")
+            with open(self.stdnode) as src, open(node_file, "w") as f:
+                f.write("# Comment\n" + src.readline() + "\n" + src.read() + "# Trailer\n")
+            with open(self.stdele) as src, open(ele_file, "w") as f:
+                f.write(src.readline() + "\n# Comment\n" + src.read())
+            eq_(parse.parse_nodes(node_file)[0], nodes)
+            eq_(parse.parse_elts(ele_file), elts)
+
+    def test_malformed_nodes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            node_file = os.path.join(tmp, "mesh.node")
+            # No boundary marker column, or rows not matching the header
+            for text in ["3 2 0 0\n0 0 0\n1 1 0\n2 1 1\n",
+                         "3 2 0 1\n0 0 0\n1 1 0\n2 1 1\n",
+                         "3\n0 0 0 1\n1 1 0 1\n2 1 1 1\n"]:
+                with open(node_file, "w") as f:
+                    f.write(text)
+                assert_raises(ValueError, parse.read_nodes, node_file)
+            # The marker follows the attributes
+            with open(node_file, "w") as f:
+                f.write("2 2 1 1\n0 0 0 1 0\n1 1 0 0 1\n")
+            assert_array_equal(parse.read_nodes(node_file)[2], [True, False])
+
+    def test_elements_without_attributes(self):
+        grid = FEGrid("test/test_inputs/DLVN.node", "test/test_inputs/DLVN.ele")
+        eq_(grid.connectivity.shape, (1528, 3))
+        assert_array_equal(grid.mat_ids, 0)
+
+    def test_malformed_elements(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ele_file = os.path.join(tmp, "mesh.ele")
+            # Rows or columns not matching the header, or quadratic elements
+            for text in ["2 3 1\n0 0 1 2 0\n", "1 3 1\n0 0 1 2\n",
+                         "1 3 0\n0 0 1 2 0 0\n", "1 6 0\n0 0 1 2 3 4 5\n"]:
+                with open(ele_file, "w") as f:
+                    f.write(text)
+                assert_raises(ValueError, parse.read_elts, ele_file)
+
+    def test_cache_key(self):
+        # The same bytes split differently between the files
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = [os.path.join(tmp, name) for name in "abcd"]
+            for path, text in zip(paths, ["AB", "C", "A", "BC"]):
+                with open(path, "w") as f:
+                    f.write(text)
+            ok_(cache.file_hash(*paths[:2]) != cache.file_hash(*paths[2:]))
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            node_file = os.path.join(tmp, "mesh.node")
+            ele_file = os.path.join(tmp, "mesh.ele")
+            with open(self.stdnode) as src, open(node_file, "w") as f:
+                f.write(src.read())
+            with open(self.stdele) as src, open(ele_file, "w") as f:
+                f.write(src.read())
+            written = FEGrid(node_file, ele_file, cache=True)
+            ok_(os.path.exists(cache.cache_path(node_file, ".grid.npz")))
+            read = FEGrid(node_file, ele_file, cache=True)
+            for name in FEGrid._cached_tables:
+                assert_array_equal(getattr(read, name), getattr(written, name))
+            assert_array_equal(read.pattern.indices, self.stdgrid.pattern.indices)
+            eq_(read.xmax, self.stdgrid.xmax)
+            # A changed input is detected and the cache rebuilt
+            with open(ele_file) as f:
+                lines = f.read().splitlines()
+            lines[1] = lines[1][:-1] + "1"
+            with open(ele_file, "w") as f:
+                f.write("\n".join(lines) + "\n")
+            eq_(FEGrid(node_file, ele_file, cache=True).mat_ids[0], 1)
+            eq_(FEGrid(node_file, ele_file, cache=True).mat_ids[0], 1)
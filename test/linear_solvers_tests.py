@@ -0,0 +1,91 @@
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+import scipy.sparse as sps
+import scipy.sparse.linalg as linalg
+
+from gallo.linear_solvers import Direct, Krylov, LinearSolver, get_linear_solver
+
+class TestLinearSolvers:
+    @classmethod
+    def setup_class(cls):
+        cls.spd = sps.diags([-1, 4, -1], [-1, 0, 1], shape=(50, 50), format='csr')
+        # Upwinded convection makes the operator nonsymmetric, like the drift term
+        cls.nonsymmetric = cls.spd + sps.diags([-1, 1], [-1, 0], shape=(50, 50), format='csr')
+        cls.rhs = np.linspace(1, 2, 50)
+
+    def test_methods(self):
+        for lhs, names in [(self.spd, ['direct', 'cg', 'cg+jacobi', 'cg+ilu']),
+                           (self.nonsymmetric, ['gmres', 'gmres+ilu', 'bicgstab+jacobi'])]:
+            expected = linalg.spsolve(lhs.tocsc(), self.rhs)
+            for name in names:
+                solver = get_linear_solver(name)
+                x = solver.solve(lambda: lhs, self.rhs)
+                assert_allclose(x, expected, rtol=1e-8)
+                eq_(solver.num_solves, 1)
+                if name != 'direct':
+                    ok_(solver.iterations > 0)
+
+    def test_keyed_setup(self):
+        calls = []
+        def make_lhs():
+            calls.append(1)
+            return self.nonsymmetric
+        for solver in [Direct(), Krylov('gmres', 'ilu')]:
+            calls.clear()
+            solver.solve(make_lhs, self.rhs, key="a")
+            solver.solve(make_lhs, 2*self.rhs, key="a")
+            eq_(len(calls), 1)
+            solver.solve(make_lhs, self.rhs)
+            eq_(len(calls), 2)
+
+    def test_shared_preconditioner(self):
+        calls = []
+        def make_shared():
+            calls.append(1)
+            return self.spd
+        solver = Krylov('gmres', 'ilu')
+        for lhs, key in [(self.spd, "a"), (self.nonsymmetric, "b")]:
+            expected = linalg.spsolve(lhs.tocsc(), self.rhs)
+            x = solver.solve(lambda: lhs, self.rhs, key=key, shared=("shared", make_shared))
+            assert_allclose(x, expected, rtol=1e-8)
+        eq_(len(calls), 1)
+
+    def test_operator_budget(self):
+        solver = Krylov('gmres', 'ilu')
+        solver.solve(lambda: self.nonsymmetric, self.rhs, key="a")
+        size = solver.nbytes
+        ok_(size > self.nonsymmetric.data.nbytes)
+        # Room for two operators, the least recently used is evicted
+        solver.max_bytes = 2 * size
+        for key in ["b", "a", "c"]:
+            solver.solve(lambda: self.nonsymmetric, self.rhs, key=key)
+        eq_(list(solver._operators), ["a", "c"])
+        eq_(solver.nbytes, 2 * size)
+        solver.clear()
+        eq_(solver.nbytes, 0)
+
+    def test_initial_guess(self):
+        solver = Krylov('cg', 'jacobi')
+        x = solver.solve(lambda: self.spd, self.rhs)
+        solver.solve(lambda: self.spd, self.rhs, x0=x)
+        eq_(solver.last_iterations, 0)
+
+    def test_loose_warm_start(self):
+        # A guess already within the requested tolerance is still improved
+        solver = Krylov('gmres', None)
+        expected = linalg.spsolve(self.nonsymmetric.tocsc(), self.rhs)
+        x0 = expected * (1 + 1e-3)
+        x = solver.solve(lambda: self.nonsymmetric, self.rhs, x0=x0, tol=1e-1)
+        ok_(solver.last_iterations > 0)
+        ok_(np.linalg.norm(x - expected) < 1e-2*np.linalg.norm(x0 - expected))
+
+    @raises(RuntimeError)
+    def test_unknown_method(self):
+        get_linear_solver('lsqr')
+
+    @raises(TypeError)
+    def test_abstract_solve(self):
+        class NoSolve(LinearSolver):
+            pass
+        NoSolve()
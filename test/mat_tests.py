@@ -2,6 +2,7 @@ from nose.tools import *
 import numpy as np
 from numpy.testing import *
 
+from gallo.fe import FEGrid
 from gallo.materials import Materials
 
 
@@ -40,3 +41,21 @@ class TestMaterials:
         mats2 = np.array([[3, 0],
                           [0, 1]])
         assert_array_equal(mats1, mats2)
+
+    def test_element_view(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/c5g7mod.mat")
+        view = mats.element_view(grid)
+        ok_(mats.element_view(grid) is view)
+        for e in [0, grid.num_elts - 1]:
+            m = grid.mat_ids[e]
+            for g in range(mats.num_groups):
+                eq_(view.sig_t[e, g], mats.get_sigt(m, g))
+                eq_(view.sig_r[e, g], mats.get_sigt(m, g) - mats.get_sigs(m)[g, g])
+            assert_array_equal(view.sig_s(2)[e], mats.get_sigs(m)[:, 2])
+        # Changed cross sections give a new view
+        mats.sig_a[:, 0] *= 2
+        mats.update()
+        new_view = mats.element_view(grid)
+        ok_(new_view is not view)
+        assert_allclose(new_view.sig_t[:, 0], mats.sig_t[grid.mat_ids, 0])
@@ -0,0 +1,48 @@
+import os
+import tempfile
+
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo.fe import FEGrid
+from gallo.formulations.diffusion import Diffusion
+from gallo.materials import Materials
+from gallo.mesh import structured_grid, structured_mesh, write_triangle
+from gallo.solvers import Solver
+
+class TestMesh:
+    @classmethod
+    def setup_class(cls):
+        cls.mesh = structured_mesh(4, 3, width=2., height=1.5, num_mats=2)
+        cls.grid = FEGrid.from_arrays(*cls.mesh)
+
+    def test_structured(self):
+        eq_(self.grid.num_elts, 2 * 4 * 3)
+        eq_(self.grid.num_nodes, 5 * 4)
+        assert_allclose(self.grid.areas, 2. * 1.5 / self.grid.num_elts)
+        eq_(self.grid.interior.sum(), 3 * 2)
+        eq_((self.grid.xmax, self.grid.ymax), (2., 1.5))
+        # Stripes of two cells per material
+        eq_(list(self.grid.mat_ids[:8]), [0, 0, 0, 0, 1, 1, 1, 1])
+
+    def test_written(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            prefix = os.path.join(tmp, "mesh")
+            write_triangle(prefix, *self.mesh)
+            grid = FEGrid(prefix + ".node", prefix + ".ele")
+        for name in FEGrid._cached_tables:
+            assert_array_equal(getattr(grid, name), getattr(self.grid, name))
+
+    def solve_test(self):
+        mats = Materials("test/test_inputs/box_source.mat")
+        grid = structured_grid(8, 8)
+        phis = Solver(Diffusion(grid, mats), verbose=False).solve(
+            np.ones((mats.num_groups, grid.num_elts)))
+        ok_((phis > 0).all())
+        # The cells are split along the same diagonal, the mesh is symmetric
+        # under a half turn and a reflection about that diagonal
+        for image in (1 - grid.positions, grid.positions[:, ::-1]):
+            nodes = [np.flatnonzero(np.isclose(grid.positions, pos).all(axis=1))[0]
+                     for pos in image]
+            assert_allclose(phis[0][nodes], phis[0], rtol=1e-10)
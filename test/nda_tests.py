@@ -17,22 +17,16 @@ class TestNDA:
         cls.mats = Materials(cls.matfile)
         cls.op = NDA(cls.fegrid, cls.mats)
 
-    # def kappa_test(self):
-    #     normal = np.array([0, 1])
-    #     psi = np.ones((4, 2))
-    #     phi = 4*np.pi*psi[0]
-    #     kappa_prime = np.array([.5773503, .5773503])
-    #     kappa = self.op.compute_kappa(normal, phi, psi)
-    #     assert_array_equal(kappa - kappa_prime, np.zeros(2))
-    #
-    # def drift_test(self):
-    #     inv_sigt = 1
-    #     D = 1/3
-    #     ngrad = np.array([1, 1])
-    #     psi = np.ones((4, 3))
-    #     phi = 4*np.pi*psi[0]
-    #     drift_vector = self.op.compute_drift_vector(inv_sigt, D, ngrad, phi, psi)
-    #     ang = np.array([.5773503, .5773503])
-    #     d_prime = (2*np.pi*ang*(ang@ngrad) - (4/3*np.pi*ngrad))/phi[0]
-    #     ones = np.ones((3, 2))
-    #     assert_array_equal(drift_vector, d_prime*ones)
+    def closure_test(self):
+        # Isotropic angular flux, the P1 closure is exact and the drift vanishes
+        psi = np.ones((self.op.num_angs, self.fegrid.num_nodes))
+        phi = self.op.weights @ psi
+        closure = self.op.compute_closure([phi, psi])
+        num_elts, num_gnodes = self.fegrid.num_elts, self.fegrid.num_gauss_nodes
+        assert_allclose(closure.zeroth_moment, np.ones((num_elts, num_gnodes)))
+        assert_allclose(closure.second_moment,
+                        np.broadcast_to(np.eye(2)/3, (num_elts, num_gnodes, 2, 2)), atol=1e-12)
+        assert_allclose(closure.kappa, 1/np.sqrt(3))
+        for g in range(self.op.num_groups):
+            tensor = self.op.drift_tensor(g, closure)
+            assert_allclose(self.op.drift_local(tensor), 0, atol=1e-12)
@@ -0,0 +1,63 @@
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo.formulations.saaf import SAAF
+from gallo.fe import FEGrid
+from gallo.materials import Materials
+from gallo.quadrature import Quadrature, get_quadrature
+from gallo.solvers import Solver
+
+class TestQuadrature:
+    @classmethod
+    def setup_class(cls):
+        cls.fegrid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        cls.mats = Materials("test/test_inputs/scattering1g.mat")
+
+    def moments_test(self):
+        for sn_ord in range(2, 18, 2):
+            quad = get_quadrature(sn_ord)
+            eq_(quad.num_angs, sn_ord*(sn_ord + 2)//2)
+            eq_(quad.angs.shape, (quad.num_angs, 2))
+            assert_allclose(quad.weights.sum(), 4*np.pi)
+            assert_allclose(quad.weights @ quad.angs, 0, atol=1e-12)
+            # Second moment of the projected directions, 4 pi/3 I
+            assert_allclose(np.einsum('a,aij->ij', quad.weights, quad.outer),
+                            4*np.pi/3*np.eye(2), atol=1e-12)
+
+    def shared_test(self):
+        ok_(get_quadrature(4) is get_quadrature(4))
+        ok_(SAAF(self.fegrid, self.mats).quadrature is get_quadrature(2))
+
+    def opposite_test(self):
+        for sn_ord in [2, 8, 16]:
+            quad = get_quadrature(sn_ord)
+            assert_array_equal(quad.angs[quad.opposite], -quad.angs)
+            assert_array_equal(quad.weights[quad.opposite], quad.weights)
+
+    @raises(RuntimeError)
+    def odd_order_test(self):
+        Quadrature(3)
+
+    def batched_lhs_test(self):
+        op = SAAF(self.fegrid, self.mats, get_quadrature(4))
+        matrices = op.make_lhs(op.angs, 0)
+        eq_(len(matrices), op.num_angs)
+        for ang, matrix in zip(op.angs, matrices):
+            assert_allclose(matrix.toarray(), op.make_lhs(ang, 0).toarray(), rtol=1e-12)
+
+    def pair_lhs_test(self):
+        op = SAAF(self.fegrid, self.mats, get_quadrature(4))
+        ang = op.angs[0]
+        average = (op.make_lhs(ang, 0) + op.make_lhs(-ang, 0)) / 2
+        assert_allclose(op.make_pair_lhs(ang, 0).toarray(), average.toarray(), rtol=1e-12)
+
+    def s4_solve_test(self):
+        source = np.ones((1, self.fegrid.num_elts))
+        s2_phis = Solver(SAAF(self.fegrid, self.mats)).solve(source)[0]
+        solver = Solver(SAAF(self.fegrid, self.mats, get_quadrature(4)))
+        phis, psis = solver.solve(source)
+        eq_(psis.shape, (1, 12, self.fegrid.num_nodes))
+        assert_allclose(solver.weights @ psis[0], phis[0])
+        # Both are close to the same transport solution
+        ok_(np.linalg.norm(phis - s2_phis) < 0.1*np.linalg.norm(s2_phis))
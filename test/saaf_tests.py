@@ -2,6 +2,7 @@ from nose.tools import *
 from numpy.testing import *
 import numpy as np
 
+from gallo import assembly
 from gallo.formulations.saaf import SAAF
 from gallo.fe import FEGrid
 from gallo.materials import Materials
@@ -72,6 +73,30 @@ class TestSAAF:
         A = self.op.make_lhs(np.array([ang_one, ang_two]), 0)
         ok_(np.allclose(A.A, A.transpose().A, rtol=1e-12))
 
+    def decomposition_test(self):
+        # Component form matches the directly assembled streaming operator
+        angles = np.array([0.3, -0.8])
+        grid = self.std3grid
+        sig_t = self.std3mats.get_sigt(0, 0)
+        local = (assembly.streaming(grid, angles)/sig_t
+                 + sig_t*assembly.mass(grid))
+        direct = grid.pattern.assemble(local).toarray()
+        direct += grid.pattern.matrix(self.std3op.boundary_data(angles)).toarray()
+        A = self.std3op.make_lhs(angles, 0).toarray()
+        ok_(np.allclose(A, direct, rtol=1e-12))
+
+    def rhs_balance_test(self):
+        # Basis functions sum to one and their gradients to zero, so the RHS
+        # sums to the total source whatever the angle
+        grid = self.std3grid
+        source = np.ones((1, grid.num_elts))
+        phi_prev = np.ones((1, grid.num_nodes))
+        sig_s = self.scatmat.get_sigs(0)[0, 0]
+        total = grid.areas.sum()*(1 + sig_s)/(4*np.pi)
+        for i, ang in enumerate(self.scat3op.angs):
+            b = self.scat3op.make_rhs(0, source, ang, i, phi_prev)
+            ok_(np.isclose(b.sum(), total))
+
     # def hand_calculation_lhs_test(self):
     #     angles0 = np.array([.5773503, .5773503])
     #     A0 = self.stdop.make_lhs(angles0, 0).todense()
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import warnings
+
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo.formulations.diffusion import Diffusion
+from gallo.formulations.saaf import SAAF
+from gallo.fe import FEGrid
+from gallo.materials import Materials
+from gallo.solvers import Solver
+from gallo.telemetry import ConvergenceWarning
+
+class TestSolver:
+    @classmethod
+    def setup_class(cls):
+        cls.nodefile = "test/test_inputs/std3.node"
+        cls.elefile = "test/test_inputs/std3.ele"
+        cls.matfile = "test/test_inputs/3gtest.mat"
+        cls.fegrid = FEGrid(cls.nodefile, cls.elefile)
+        cls.mats = Materials(cls.matfile)
+        cls.source = np.ones((cls.mats.num_groups, cls.fegrid.num_elts))
+        cls.saaf_phis, cls.saaf_psis = Solver(SAAF(cls.fegrid, cls.mats)).solve(cls.source)
+
+    def test_angle_workers(self):
+        solver = Solver(SAAF(self.fegrid, self.mats), angle_workers=4)
+        phis, psis = solver.solve(self.source)
+        solver.close()
+        assert_allclose(phis, self.saaf_phis, rtol=1e-12)
+        assert_allclose(psis, self.saaf_psis, rtol=1e-12)
+
+    def test_pair_preconditioners(self):
+        solver = Solver(SAAF(self.fegrid, self.mats), linear_solver='gmres+ilu',
+                        inexact=False, pair_preconditioners=True)
+        phis, psis = solver.solve(self.source)
+        assert_allclose(phis, self.saaf_phis, rtol=1e-6)
+        # One preconditioner for every pair of directions of every group
+        operators = solver.linear_solver._operators
+        eq_(len(operators), self.mats.num_groups * 3 * solver.num_angs // 2)
+
+    def test_changed_materials(self):
+        mats = Materials("test/test_inputs/3gtest.mat")
+        solver = Solver(SAAF(self.fegrid, mats))
+        solver.solve(self.source)
+        mats.sig_a *= 2
+        mats.update()
+        expected = Solver(SAAF(self.fegrid, mats)).solve(self.source)[0]
+        assert_allclose(solver.solve(self.source)[0], expected, rtol=1e-12)
+
+    def test_first_upscatter_group(self):
+        eq_(Solver(Diffusion(self.fegrid, self.mats)).first_upscatter_group(), 0)
+        mats = Materials("test/test_inputs/c5g7mod.mat")
+        eq_(Solver(Diffusion(self.fegrid, mats)).first_upscatter_group(), 3)
+
+    def test_jacobi_outer(self):
+        mats = Materials("test/test_inputs/c5g7mod.mat")
+        source = np.ones((mats.num_groups, self.fegrid.num_elts))
+        expected = Solver(Diffusion(self.fegrid, mats)).solve(source)
+        solver = Solver(Diffusion(self.fegrid, mats), outer='jacobi', group_workers=2)
+        phis = solver.solve(source)
+        solver.close()
+        assert_allclose(phis, expected, rtol=1e-4)
+
+    def test_block_outer(self):
+        mats = Materials("test/test_inputs/c5g7mod.mat")
+        source = np.ones((mats.num_groups, self.fegrid.num_elts))
+        expected = Solver(Diffusion(self.fegrid, mats)).solve(source)
+        for linear_solver in ['direct', 'gmres+block-jacobi']:
+            solver = Solver(Diffusion(self.fegrid, mats), outer='block',
+                            block_linear_solver=linear_solver)
+            assert_allclose(solver.solve(source), expected, rtol=1e-5)
+
+    def test_gmres_inner(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/scattering1g.mat")
+        source = np.ones((1, grid.num_elts))
+        expected = Solver(SAAF(grid, mats)).solve(source)[0]
+        solver = Solver(SAAF(grid, mats), inner='gmres')
+        phis, psis = solver.solve(source)
+        assert_allclose(phis, expected, rtol=1e-4)
+        assert_allclose(solver.weights @ psis[0], phis[0])
+        residuals = solver.krylov_residuals[0]
+        ok_(len(residuals) < 10)
+        ok_(residuals[-1] < 1e-6)
+        # max_iter bounds the GMRES iterations, not its restart cycles
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            solver.solve_in_group(source, 0, np.ones((1, grid.num_nodes)),
+                                  max_iter=3, tol=1e-14)
+        eq_(len(solver.krylov_residuals[0]), 3)
+        eq_([warning.category for warning in caught], [ConvergenceWarning])
+
+    def test_scattering_not_in_last_material(self):
+        grid = FEGrid("test/test_inputs/box_source.node", "test/test_inputs/box_source.ele")
+        with tempfile.TemporaryDirectory() as tmp:
+            matfile = os.path.join(tmp, "core_scatters.mat")
+            with open(matfile, "w") as f:
+                f.write("2 | 1\n"
+                        "0 | 0 | 'core' | 9 | 5 | 4 | 3 | 2.43 | 0\n"
+                        "1 | 0 | 'reflector' | 3 | 3 | 0 | 0 | 0 | 0\n")
+            mats = Materials(matfile)
+        source = np.ones((1, grid.num_elts))
+        solver = Solver(Diffusion(grid, mats))
+        ok_(solver.has_scattering())
+        phis = solver.solve(source)
+        ok_(solver.report.inner_iterations[0] > 1)
+        expected = Solver(Diffusion(grid, mats), outer='block').solve(source)
+        assert_allclose(phis, expected, rtol=1e-5)
+
+    def test_anderson_outer(self):
+        expected = Solver(Diffusion(self.fegrid, self.mats), outer='block').solve(self.source)
+        solver = Solver(Diffusion(self.fegrid, self.mats), anderson_depth=5)
+        assert_allclose(solver.solve(self.source), expected, rtol=1e-5)
+        ok_(solver.anderson.mixed_steps > 0)
+
+    def test_eigenvalue(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/fissiontest.mat")
+        op = Diffusion(grid, mats)
+        # Largest eigenvalue of L^-1 F for the block system
+        lhs = op.get_matrix("all").toarray()
+        fission = op.get_fission_matrix().toarray()
+        expected = np.abs(np.linalg.eigvals(np.linalg.solve(lhs, fission))).max()
+        for acceleration in [None, 'chebyshev', 'wielandt']:
+            k, phis = Solver(Diffusion(grid, mats)).solve_eigenvalue(
+                acceleration=acceleration, tol=1e-8, warmup=2)
+            assert_allclose(k, expected, rtol=1e-6)
+            ok_((phis > 0).all())
+
+    def test_saaf_eigenvalue(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/c5g7uo2.mat")
+        k, phis, psis = Solver(SAAF(grid, mats)).solve_eigenvalue(tol=1e-8)
+        k_chebyshev = Solver(SAAF(grid, mats)).solve_eigenvalue(
+            acceleration='chebyshev', tol=1e-8)[0]
+        assert_allclose(k_chebyshev, k, rtol=1e-6)
+        eq_(psis.shape, (mats.num_groups, 4, grid.num_nodes))
+
+    def test_upscatter_acceleration_only_nda(self):
+        for op in [Diffusion(self.fegrid, self.mats), SAAF(self.fegrid, self.mats)]:
+            solver = Solver(op)
+            assert_raises(RuntimeError, solver.solve, self.source, True)
+            ok_(not solver.ua_bool)
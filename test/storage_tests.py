@@ -0,0 +1,90 @@
+import gc
+import os
+import tempfile
+
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo.formulations.nda import NDA
+from gallo.formulations.saaf import SAAF
+from gallo.fe import FEGrid
+from gallo.materials import Materials
+from gallo.quadrature import get_quadrature
+from gallo.solvers import Solver
+from gallo.storage import AngularFluxStorage, get_storage
+
+class TestStorage:
+    @classmethod
+    def setup_class(cls):
+        cls.fegrid = FEGrid("test/test_inputs/std3.node", "test/test_inputs/std3.ele")
+        cls.mats = Materials("test/test_inputs/3gtest.mat")
+        cls.source = np.ones((cls.mats.num_groups, cls.fegrid.num_elts))
+        cls.solver = Solver(SAAF(cls.fegrid, cls.mats))
+        cls.phis, cls.psis = cls.solver.solve(cls.source)
+
+    def memmap_test(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "psi.npy")
+            solver = Solver(SAAF(self.fegrid, self.mats), angular_storage='memmap',
+                            storage_path=path)
+            phis, psis = solver.solve(self.source)
+            solver.close()
+            assert_allclose(phis, self.phis, rtol=1e-12)
+            assert_allclose(np.load(path), self.psis, rtol=1e-12)
+
+    def temporary_file_test(self):
+        storage = get_storage('memmap', get_quadrature(2), 2, 5)
+        storage.write(1, np.ones((4, 5)))
+        ok_(os.path.exists(storage.path))
+        storage.close()
+        ok_(not os.path.exists(storage.path))
+
+    def memmap_results_kept_test(self):
+        solver = Solver(SAAF(self.fegrid, self.mats), angular_storage='memmap')
+        psis = solver.solve(self.source)[1]
+        first = np.array(psis)
+        solver.solve(2 * self.source)
+        assert_array_equal(psis, first)
+        ok_(not psis.flags.writeable)
+        solver.close()
+
+    def garbage_collected_test(self):
+        storage = get_storage('memmap', get_quadrature(2), 2, 5)
+        path = storage.path
+        del storage
+        gc.collect()
+        ok_(not os.path.exists(path))
+
+    @raises(TypeError)
+    def abstract_storage_test(self):
+        AngularFluxStorage(get_quadrature(2), 1, 1)
+
+    def moments_test(self):
+        solver = Solver(SAAF(self.fegrid, self.mats), angular_storage='moments')
+        phis, psis = solver.solve(self.source)
+        ok_(psis is None)
+        assert_allclose(phis, self.phis, rtol=1e-12)
+        quad = solver.quadrature
+        current = np.einsum('a,ai,gan->gin', quad.weights, quad.angs, self.psis)
+        assert_allclose(solver.angular_storage.current, current, atol=1e-12)
+        assert_allclose(self.solver.angular_storage.current, current, atol=1e-12)
+
+    @raises(RuntimeError)
+    def moments_upscatter_acceleration_test(self):
+        Solver(NDA(self.fegrid, self.mats), angular_storage='moments').solve(self.source, True)
+
+    @raises(RuntimeError)
+    def unknown_storage_test(self):
+        get_storage('disk', get_quadrature(2), 1, 1)
+
+    def angular_guesses_test(self):
+        # Iterative solves start from the last angular fluxes, which are not
+        # kept in RAM out of memory storage
+        for spec in ['memmap', 'moments']:
+            solver = Solver(SAAF(self.fegrid, self.mats), linear_solver='gmres+ilu',
+                            angular_storage=spec)
+            phis = solver.solve(self.source)[0]
+            assert_allclose(phis, self.phis, rtol=1e-6)
+            eq_([key for key in solver.guesses if isinstance(key, tuple)], [])
+            solver.close()
@@ -0,0 +1,115 @@
+import concurrent.futures
+import contextlib
+import io
+import time
+import warnings
+
+from nose.tools import *
+from numpy.testing import *
+import numpy as np
+
+from gallo import telemetry
+from gallo.formulations.diffusion import Diffusion
+from gallo.formulations.nda import NDA
+from gallo.formulations.saaf import SAAF
+from gallo.fe import FEGrid
+from gallo.linear_solvers import Krylov
+from gallo.materials import Materials
+from gallo.solvers import Solver
+from gallo.telemetry import ConvergenceWarning, Telemetry
+
+class TestTelemetry:
+    @classmethod
+    def setup_class(cls):
+        cls.fegrid = FEGrid("test/test_inputs/std3.node", "test/test_inputs/std3.ele")
+        cls.mats = Materials("test/test_inputs/3gtest.mat")
+        cls.source = np.ones((cls.mats.num_groups, cls.fegrid.num_elts))
+
+    def test_report(self):
+        events = []
+        solver = Solver(SAAF(self.fegrid, self.mats), callbacks=[events.append])
+        phis, psis, report = solver.solve(self.source, report=True)
+        ok_(report is solver.report)
+        eq_(report.timers, {})
+        outer = [event.residual for event in events if event.kind == 'outer']
+        eq_(report.outer_residuals, outer)
+        eq_(report.outer_iterations, len(outer))
+        ok_(report.outer_residuals[-1] < 1e-5)
+        inner = [event for event in events if event.kind == 'inner']
+        eq_(sum(report.inner_iterations.values()), len(inner))
+        # Directly solved, one solve of every angle of every within-group iteration
+        eq_(report.linear_solvers['linear_solver']['solves'], len(inner) * solver.num_angs)
+        eq_(report.factorizations['misses'], self.mats.num_groups * solver.num_angs)
+        eq_(set(report.setup), {'parse', 'geometry'})
+        # Only this solve is counted
+        solver.solve(self.source)
+        eq_(solver.report.factorizations['misses'], 0)
+        assert_allclose(solver.solve(self.source)[0], phis)
+
+    def test_timing(self):
+        solver = Solver(NDA(self.fegrid, self.mats), timing=True, verbose=False)
+        solver.solve(self.source, True)
+        timers = solver.report.timers
+        for phase in ['assembly', 'rhs', 'interpolation', 'linear_solve', 'ua']:
+            ok_(timers[phase] > 0, phase)
+        ok_(solver.report.linear_solvers['ho']['solves'] > 0)
+        # Nothing is timed outside of a solve
+        ok_(telemetry.active() is None)
+
+    def test_eigenvalue(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/fissiontest.mat")
+        k, phis, report = Solver(Diffusion(grid, mats)).solve_eigenvalue(
+            tol=1e-8, verbose=False, report=True)
+        eq_(report.eigenvalues[-1], k)
+
+    def test_quiet(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            Solver(Diffusion(self.fegrid, self.mats)).solve(self.source)
+        eq_(output.getvalue(), "")
+
+    def test_warnings(self):
+        grid = FEGrid("test/test_inputs/symmetric.node", "test/test_inputs/symmetric.ele")
+        mats = Materials("test/test_inputs/fissiontest.mat")
+        solver = Solver(Diffusion(grid, mats))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            solver.solve_eigenvalue(max_iter=2)
+        eq_([warning.category for warning in caught], [ConvergenceWarning])
+        eq_(solver.report.warnings, [str(caught[0].message)])
+
+    def test_linear_solver_warnings(self):
+        solver = Solver(Diffusion(self.fegrid, self.mats),
+                        linear_solver=Krylov('cg', None, maxiter=1))
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            solver.solve(self.source)
+        ok_(solver.report.warnings)
+        eq_(solver.report.warnings, [str(warning.message) for warning in caught])
+        ok_(all("cg did not converge" in message for message in solver.report.warnings))
+
+    def test_concurrent_solves(self):
+        # Every solve times its own phases, also those of its worker threads
+        solvers = [Solver(SAAF(self.fegrid, self.mats), timing=True, angle_workers=2)
+                   for _ in range(2)]
+        with concurrent.futures.ThreadPoolExecutor(2) as pool:
+            list(pool.map(lambda solver: solver.solve(self.source), solvers))
+        for solver in solvers:
+            report = solver.report
+            eq_(report.calls['linear_solve'], report.linear_solvers['linear_solver']['solves'])
+            ok_(report.timers['assembly'] > 0)
+        ok_(telemetry.active() is None)
+
+    def test_nested_phases(self):
+        record = Telemetry(timing=True)
+        ok_(telemetry.phase('outer') is telemetry._NULL)
+        with record.active():
+            with telemetry.phase('outer'):
+                time.sleep(0.02)
+                with telemetry.phase('inner'):
+                    time.sleep(0.02)
+        # Time in nested phases is not counted in the enclosing one
+        ok_(0.015 < record.timers['outer'] < 0.035)
+        ok_(record.timers['inner'] > 0.015)
+        eq_(record.calls, {'outer': 1, 'inner': 1})